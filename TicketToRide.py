@@ -4,11 +4,13 @@ from copy import deepcopy
 
 map = "USA"          # Map specification
 games = 1            # Games to simulate
-logs = True          # Basic logging to log.txt (only shows last played game)
+logs = True          # Basic logging to log.txt (every game played)
 debug = False        # Detailed logging to log.txt
 drawGame = False     # See the game results (only relevant if simulating one game)
+workers = 1          # Processes to simulate games on (only relevant if simulating multiple games)
 agents = [Random("Larry"), Random("David"), Random("Test")] # Player specification 
 
 # MCTS Testing
-ticketToRideGame = play(map, agents, logs, debug, games, drawGame)
+if __name__ == "__main__":
+    ticketToRideGame = play(map, agents, logs, debug, games, drawGame, workers)
 # This game will stop at some point with 4% chance and do MCTS on that state
\ No newline at end of file
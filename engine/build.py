@@ -1,18 +1,25 @@
 import time
+import numpy
 import random
 import networkx as nx
 from copy import deepcopy
-from itertools import repeat
 from matplotlib import pyplot
 from collections import deque
 from engine.players import Agent
+from engine.compact import CompactState, WILD
+from engine.logs import GameLog, INFO, DEBUG, openSink
+from engine.observation import Observation
+from engine.records import GameRecord, getTraceCodes
+from engine.scoring import CityConnectivity, LongestRoute, buildConnectivity, buildLongestRoute, longestRouteWinners
 # from models.mcts import MonteCarloSearch, Node
-from engine.data import getPaths, getDestinationCards, listColors, pointsByLength, colors, getPathsAM
+from engine.data import MapData, GRAY, getMap, bitIndexes, getDestinationCards, handColors, indexByColor, pointsByLength, colors, getPathsAM, longestRouteBonus
+
+START_TURN, SECOND_DRAW, DESTINATION_CHOICE, GAME_OVER, END_TURN = 0, 1, 2, 3, 4
+"""Turn phases of Game.step: the start of a turn (or choosing again after a route could not be placed), the second card draw, choosing from a destination deal, the game stopped during the turn and the turn being over"""
 
 """
 TODO:
-1. Longest route bonus is not given out at the end.
-2. clearing of face up cards in specific cirumstances has not been implemented yet. (ex. 3 wilds on the board clears the face up deck)
+1. clearing of face up cards in specific cirumstances has not been implemented yet. (ex. 3 wilds on the board clears the face up deck)
 """
 
 class State:
@@ -49,6 +56,8 @@ class Action:
         """Turn action indexes: 0 - Place Trains, 1 - Draw (Face Up), 2 - Draw (Face Down), 3 - Draw (Destination Cards)"""
         self.routeToPlace = None
         self.colorsUsed = None
+        self.colorPicked = None
+        self.destinationsPicked = None
 
         if self.action == 0:
 
@@ -91,7 +100,7 @@ class Action:
 
 class Game:
 
-    def __init__(self, map: str, players: list[Agent], logs: bool, debug=False, drawGame=False, state: State = None) -> None:
+    def __init__(self, map: str, players: list[Agent], logs: bool, debug=False, drawGame=False, state: State | CompactState = None, gameLog: GameLog = None, seed: int = None) -> None:
         """
         The Ticket to Ride game engine in python.
 
@@ -105,16 +114,25 @@ class Game:
 
         drawGame = a boolean to see a loose representation of the ending game map
 
-        state = if a state of a game is given, this will initialize a frozen Game object in which moves can manually be performed.
+        state = if a state (State or CompactState) of a game is given, this will initialize a frozen Game object in which moves can manually be performed.
+
+        gameLog = an engine.logs.GameLog to stream the game log to (Logs and Debug are then ignored), for example to keep the logs of every game of a batch in one file
+
+        seed = seeds the shuffles of the players and decks (a random seed if None), the game can be replayed from it and the trace (see record)
         """
         if state != None:
             self.setGame(state)
         else:
             self.endedGame = False
             self.lastTurn = None
-            self.logs = []
-            self.debug = debug
-            self.doLogs = logs
+            self.ownsLog = gameLog == None and logs
+            """Whether the game opened log.txt itself (and closes it when done)"""
+            if gameLog != None:
+                self.gameLog = gameLog
+            elif logs:
+                self.gameLog = GameLog(openSink("log.txt"), DEBUG if debug else INFO)
+            else:
+                self.gameLog = GameLog()
             self.mapName = map
             self.gameOver = False
             self.drawGame = drawGame
@@ -126,40 +144,68 @@ class Game:
             self.faceUpCards: list[str]
             self.destinationDeal: list[list] = None
             self.board: nx.MultiGraph
+            self.mapData: MapData
+            self.ownedRoutes: list[int]
+            """Per player (by turn order) bitmask of the routes owned, one bit per route index"""
+            self.unclaimedRoutes: int
+            """Bitmask of the routes on the board nobody has claimed yet"""
+            self.openRoutes: dict[tuple[int, int], int]
+            """Bitmasks of the unclaimed routes grouped by (color index, GRAY for gray, weight)"""
+            self.connectivity: list[CityConnectivity]
+            """Per player (by turn order) union-find of the cities joined by their routes"""
+            self.longestRoutes: list[LongestRoute]
+            """Per player (by turn order) longest continuous route cache"""
             self.wildFromFaceUp = False
             self.movePerforming = None
             self.colorPicked: str
             """Denotes which move (by index) has changed the game state but not whose turn it is. None if turn is new"""
             if self.players == None:
                 raise ValueError("There must be between 2-4 players.")
-            random.shuffle(self.players)
+            self.seed = random.getrandbits(64) if seed == None else seed
+            self.names = [player.name for player in self.players]
+            self.trace: list[int] = []
+            """The codes (engine.records.TraceCodes) of every turn start and move, in order"""
+            self.codes = getTraceCodes(map)
+            self.observation = Observation(self)
+            """What agents are shown of the game when asked for a turn"""
+            setup = random.Random(self.seed)
+            setup.shuffle(self.players)
             self.turn = 1 - len(players)
             self.actionMap = dict[int, list]
-            self.build()
+            self.build(setup)
             self.getActionMap()
             self.init()
             self.play()
             self.endGame()
-            if self.doLogs == True:
+            if self.ownsLog:
                 self.log()
             if self.drawGame:
                 pyplot.show()
 
-    def build(self) -> None:
+    def build(self, setup: random.Random) -> None:
         """
-        Builds a networkx MultiGraph representation of the map and the decks to be used as deques
+        Builds a networkx MultiGraph representation of the map and the decks to be used as deques, shuffled with the setup RNG
         """
 
         # Build the board
+        self.mapData = getMap(self.mapName)
         self.board = nx.MultiGraph()
         if len(self.players) == 4:
-            self.board.add_edges_from((path[0], path[3], {'weight': int(path[1]), 'color': path[2], 'owner': '', 'index': path[4]}) for path in getPaths(self.mapName))
+            self.board.add_edges_from((edge[0], edge[1], dict(edge[2])) for edge in self.mapData.edges)
         else:
-            self.board.add_edges_from((path[0], path[3], {'weight': int(path[1]), 'color': path[2], 'owner': '', 'index': path[4]}) for path in getPaths(self.mapName) if self.board.has_edge(path[0], path[3]) == False)
+            # Only the first track of double routes is claimable
+            self.board.add_edges_from((edge[0], edge[1], dict(edge[2])) for edge in self.mapData.edges if not (0 <= self.mapData.sibling[edge[2]['index']] < edge[2]['index']))
+        self.ownedRoutes = [0]*len(self.players)
+        self.unclaimedRoutes = 0
+        for edge in self.board.edges(data=True):
+            self.unclaimedRoutes |= self.mapData.routeBit[edge[2]['index']]
+        self.buildOpenRoutes()
+        self.connectivity = [CityConnectivity(len(self.mapData.cities)) for _ in self.players]
+        self.longestRoutes = [LongestRoute() for _ in self.players]
 
         # Build the train car deck
         traincar_deck = ['PINK']*12+['WHITE']*12+['BLUE']*12+['YELLOW']*12+['ORANGE']*12+['BLACK']*12+['RED']*12+['GREEN']*12+['WILD']*14
-        random.shuffle(traincar_deck)
+        setup.shuffle(traincar_deck)
         self.trainCarDeck = deque(traincar_deck)
 
         # Deal the face up cards
@@ -168,7 +214,7 @@ class Game:
         # Build the destination deck
         destination_deck = getDestinationCards(self.mapName)
         self.destinationCards = deepcopy(destination_deck)
-        random.shuffle(destination_deck)
+        setup.shuffle(destination_deck)
         destination_deck = deque(destination_deck)
         self.destinationsDeck = destination_deck
     
@@ -176,20 +222,15 @@ class Game:
         """
         Initializes the game board and players for playing to begin.
         """
-        if self.doLogs == True:
-            logStr = ""
         for i, player in enumerate(self.players):
             for _ in range(4):
-                player.hand_trainCards.append(self.trainCarDeck.pop())
+                player.hand_trainCards[indexByColor[self.trainCarDeck.pop()]] += 1
             player.colorCounting = [[0, 0, 0, 0, 0, 0, 0, 0, 0, 4], [0, 0, 0, 0, 0, 0, 0, 0, 0, 4], [0, 0, 0, 0, 0, 0, 0, 0, 0, 4], [0, 0, 0, 0, 0, 0, 0, 0, 0, 4]]
             player.turnOrder = i
-
-            if self.doLogs == True:
-                logStr = logStr + f"{player.turnOrder}. {player.name}\n"
             # print(player.name, player.turnOrder, player.hand_trainCards)
         
-        if self.doLogs == True:
-            self.logs = ["TICKET TO RIDE\n", logStr, "--------------------\n"]
+        if self.gameLog.info:
+            self.gameLog.write(INFO, "start", "TICKET TO RIDE\n{players}--------------------\n", players="".join(f"{player.turnOrder}. {player.name}\n" for player in self.players))
     
     def getActionMap(self) -> None:
         """
@@ -205,10 +246,12 @@ class Game:
         """
         self.actionMap = { 0: list(getPathsAM(self.mapName)), 1: self.faceUpCards, 2: self.trainCarDeck, 3: self.destinationCards }
     
-    def setGame(self, state: State) -> None:
+    def setGame(self, state: State | CompactState) -> None:
         """
         Builds a frozen game object from a given state where moves can be manually performed.
         """
+        if isinstance(state, CompactState):
+            state = state.toState()
         self.movePerforming = state.followUpFromMove
         self.board = deepcopy(state.board)
         self.destinationDeal = deepcopy(state.destinationDeal)
@@ -220,22 +263,97 @@ class Game:
         self.players = deepcopy(state.players)
         self.validGameMoves = state.validMoves
         self.mapName = state.map
+        self.mapData = getMap(self.mapName)
+        self.ownedRoutes = [0]*len(self.players)
+        self.unclaimedRoutes = 0
+        for edge in self.board.edges(data=True):
+            if edge[2]['owner'] == '':
+                self.unclaimedRoutes |= self.mapData.routeBit[edge[2]['index']]
+            else:
+                self.ownedRoutes[edge[2]['owner']] |= self.mapData.routeBit[edge[2]['index']]
+        self.buildOpenRoutes()
+        self.connectivity = [buildConnectivity(self.mapData, bitIndexes(owned)) for owned in self.ownedRoutes]
+        self.longestRoutes = [buildLongestRoute(self.mapData, connectivity, owned) for connectivity, owned in zip(self.connectivity, self.ownedRoutes)]
         self.destinationCards = getDestinationCards(self.mapName)
         self.actionMap = state.actionMap
-        self.debug = False
-        self.doLogs = False
+        self.trace = []
+        self.codes = getTraceCodes(self.mapName)
+        self.observation = Observation(self)
+        self.gameLog = GameLog()
+        self.ownsLog = False
         self.colorPicked: str = None
         self.endedGame = state.endedGame
         self.lastTurn = state.lastTurn
         self.gameOver = state.gameOver
 
-    def placeTrains(self, player: Agent, actionDistribution: list[int], cardDistribution: list[str]) -> None:
+    def buildOpenRoutes(self) -> None:
+        """
+        Groups the unclaimed routes by color and weight (see openRoutes)
+        """
+        self.openRoutes = {}
+        for index in bitIndexes(self.unclaimedRoutes):
+            group = (self.mapData.color[index], self.mapData.weight[index])
+            self.openRoutes[group] = self.openRoutes.get(group, 0) | self.mapData.routeBit[index]
+
+    def placeableRoutes(self, player: Agent) -> int:
+        """
+        Bitmask of the unclaimed routes the player has the trains and the cards for, going by the groups of openRoutes. Gray routes are included when the player's largest color plus wilds covers them, so every route placeTrains could pay for is in it.
+        """
+        hand = player.hand_trainCards
+        wilds = hand[WILD]
+        mostColor = max(hand[:WILD])
+        routes = 0
+        for (color, weight), unclaimed in self.openRoutes.items():
+            if weight > player.trainsLeft:
+                continue
+            if color == GRAY:
+                if mostColor + wilds >= weight:
+                    routes |= unclaimed
+            elif hand[color] >= weight or wilds >= weight:
+                routes |= unclaimed
+        return routes
+
+    def isClaimable(self, player: Agent, index: int) -> bool:
+        """
+        Whether the route (by index) is unclaimed and the player does not own the other track of its double route
+        """
+        return self.unclaimedRoutes & self.mapData.routeBit[index] != 0 and self.ownedRoutes[player.turnOrder] & self.mapData.siblingBit[index] == 0
+
+    def claimRoute(self, player: Agent, index: int) -> None:
+        """
+        Gives the route (by index) to the player on the route bitmasks and on the board
+        """
+        self.ownedRoutes[player.turnOrder] |= self.mapData.routeBit[index]
+        self.unclaimedRoutes &= ~self.mapData.routeBit[index]
+        self.openRoutes[(self.mapData.color[index], self.mapData.weight[index])] &= ~self.mapData.routeBit[index]
+        self.connectivity[player.turnOrder].addRoute(self.mapData, index)
+        self.longestRoutes[player.turnOrder].addRoute(self.mapData, self.connectivity[player.turnOrder], index)
+        for path in self.board.get_edge_data(self.mapData.city1[index], self.mapData.city2[index]).values():
+            if path['index'] == index:
+                path['owner'] = player.turnOrder
+                break
+
+    def isTicketComplete(self, player: Agent, destination: list[str]) -> bool:
+        """
+        Whether the player's routes currently connect the cities of a destination card
+        """
+        return self.connectivity[player.turnOrder].isTicketComplete(self.mapData, destination[3])
+
+    def longestRoute(self, player: Agent) -> int:
+        """
+        The length (in trains) of the player's current longest continuous route
+        """
+        return self.longestRoutes[player.turnOrder].longest(self.mapData, self.connectivity[player.turnOrder], self.ownedRoutes[player.turnOrder])
+
+    def placeTrains(self, player: Agent, actionDistribution: list[int], cardDistribution: list[str]) -> bool:
         """
         Takes the distributions for placing trains and performs the move for the game. Uses the player object, actionDistribution, and cardDistribution.
 
         NOTE: It will check all possible colors first, if nothing works, it will then check (from least to most desired) if wilds can fill up the rest.
 
         Outputs the cards to use in a list (from the agent) and the route as the given tuple from networkx
+
+        Returns False if none of the wanted routes could be placed
         """
         # 1. See if the player can afford that action
         # 2. See if the edge is taken
@@ -244,39 +362,39 @@ class Game:
         isTaken = False
         cards = list[str]
         route = None
+        # Routes the player can not pay for are skipped outright, unless the debug log lists every wanted route
+        placeable = -1 if self.gameLog.debug else self.placeableRoutes(player)
+        routeBit = self.mapData.routeBit
+        if placeable == 0:
+            actionDistribution = ()
 
         for action in actionDistribution:
-            isTaken = False
             route = self.actionMap[0][action]
-            if len(self.board.get_edge_data(route[0], route[1]).values()) > 1:
-                for path in self.board.get_edge_data(route[0], route[1]).values():
-                    if path['owner'] == '':
-                        isTaken = False
-                    elif path['owner'] == player.turnOrder:
-                        isTaken = True
-                        break
-            else:
-                if self.board.get_edge_data(route[0], route[1])[0]['owner'] != '':
-                    isTaken = True
+            if placeable & routeBit[route[3]['index']] == 0:
+                continue
+            isTaken = not self.isClaimable(player, route[3]['index'])
 
             # Debug Log
-            if self.debug and isTaken:
-                self.logs = self.logs + [f"    wanted {route} but taken.\n"]
+            if self.gameLog.debug and isTaken:
+                self.gameLog.write(DEBUG, "wanted", "    wanted {route} but taken.\n", route=route, reason="taken")
 
             if isTaken:
                 continue
 
             if route[3].get('weight') > player.trainsLeft:
-                if self.debug:
-                    self.logs = self.logs + [f"    wanted {route} but not enough trains.\n"]
+                if self.gameLog.debug:
+                    self.gameLog.write(DEBUG, "wanted", "    wanted {route} but not enough trains.\n", route=route, reason="trains")
                 continue
 
-            # see if player has the cards to place route
+            # see if player has the cards to place route (cards are counts indexed by color like the hand)
             # 1. Update the player train count and the player hand
             # 2. Update the game board
+            weight = route[3].get('weight')
+            hand = player.hand_trainCards
+            cards = [0]*9
             if route[3].get('color') == 'GRAY':
                 
-                playerWildNum = player.hand_trainCards.count('WILD')
+                playerWildNum = hand[WILD]
                 wildFound = False
 
                 for color in reversed(cardDistribution):
@@ -285,79 +403,78 @@ class Game:
                         wildFound = True
                         if len(cardDistribution) != 1:
                             continue
-                    playerColorNum = player.hand_trainCards.count(color)
+                    playerColorNum = hand[indexByColor[color]] if color != 'WILD' else 0
 
                     if wildFound:
-                        if playerWildNum >= route[3].get('weight'):
-                            cards = list(repeat('WILD', route[3].get('weight')))
-                            canAfford = True
-                            break
-                        elif playerWildNum + playerColorNum == route[3].get('weight'):
-                            cards = list(repeat('WILD', playerWildNum)) + list(repeat(color, playerColorNum))
+                        if playerWildNum >= weight:
+                            cards[WILD] = weight
                             canAfford = True
                             break
-                        elif playerWildNum + playerColorNum > route[3].get('weight'):
-                            playerColorNum = route[3].get('weight') - playerWildNum
-                            cards = list(repeat('WILD', playerWildNum)) + list(repeat(color, playerColorNum))
+                        elif playerWildNum + playerColorNum >= weight:
+                            cards[WILD] = playerWildNum
+                            cards[indexByColor[color]] = weight - playerWildNum
                             canAfford = True
                             break
                     else:
-                        if playerColorNum >= route[3].get('weight'):
-                            cards = list(repeat(color, route[3].get('weight')))
+                        if playerColorNum >= weight:
+                            cards[indexByColor[color]] = weight
                             canAfford = True
                             break
             else:
+                routeColor = indexByColor[route[3].get('color')]
                 if 'WILD' in cardDistribution and cardDistribution.index('WILD') < cardDistribution.index(route[3].get('color')):
-                    if player.hand_trainCards.count(route[3].get('color')) >= route[3].get('weight'):
-                        cards = list(repeat(route[3].get('color'), route[3].get('weight')))
+                    if hand[routeColor] >= weight:
+                        cards[routeColor] = weight
                         canAfford = True
-                    elif player.hand_trainCards.count('WILD') >= route[3].get('weight'):
-                        cards = list(repeat('WILD', route[3].get('weight')))
+                    elif hand[WILD] >= weight:
+                        cards[WILD] = weight
                         canAfford = True
                 else:
-                    if player.hand_trainCards.count('WILD') >= route[3].get('weight'):
-                        cards = list(repeat('WILD', route[3].get('weight')))
+                    if hand[WILD] >= weight:
+                        cards[WILD] = weight
                         canAfford = True
-                    elif player.hand_trainCards.count(route[3].get('color')) >= route[3].get('weight'):
-                        cards = list(repeat(route[3].get('color'), route[3].get('weight')))
+                    elif hand[routeColor] >= weight:
+                        cards[routeColor] = weight
                         canAfford = True
             
-            if self.debug and canAfford == False:
-                self.logs = self.logs + [f"    wanted {route} but lacking cards.\n"]
+            if self.gameLog.debug and canAfford == False:
+                self.gameLog.write(DEBUG, "wanted", "    wanted {route} but lacking cards.\n", route=route, reason="cards")
 
             if canAfford:
                 # print(f"   {self.board.get_edge_data(route[0], route[1]).values()}")
-                if self.doLogs:
-                    self.logs = self.logs + [f"   placed {route} using {cards}\n"]
+                if self.gameLog.info:
+                    self.gameLog.write(INFO, "placed", "   placed {route} using {cards}\n", route=route, cards=handColors(cards))
+                self.trace.append(self.codes.claim(route[3]['index'], cards))
                 # Card counting
-                colorIndexes = listColors()
-                for agent in self.players:
-                    for color_ in cards:
-                        if agent.colorCounting[player.turnOrder][colorIndexes.index(color_)] != 0:
-                            agent.colorCounting[player.turnOrder][colorIndexes.index(color_)] -= 1
-                        else:
-                            agent.colorCounting[player.turnOrder][9] -= 1
+                self.countPlaced(player, cards)
                 # 1. Update the player train count and the player hand
-                player.points += pointsByLength[route[3].get('weight')]
-                player.trainsLeft = player.trainsLeft - route[3].get('weight')
-                for color in cards:
-                    player.hand_trainCards.remove(color)
+                player.points += pointsByLength[weight]
+                player.trainsLeft = player.trainsLeft - weight
+                for color, count in enumerate(cards):
+                    hand[color] -= count
                 # 2. Update the game board
-                for path in self.board.get_edge_data(route[0], route[1]).values():
-                    if path['owner'] == '':
-                        path['owner'] = player.turnOrder
-                        break
+                self.claimRoute(player, route[3]['index'])
                 # print(f"   {self.board.get_edge_data(route[0], route[1]).values()}")
                 break
         
         if canAfford == False and self.validGameMoves == [0]:
-            if self.doLogs:
-                self.logs = self.logs + [f"   PLAYER {player.turnOrder} has no more valid moves. Game must end. {self.validGameMoves}\n"]
+            if self.gameLog.info:
+                self.gameLog.write(INFO, "noMoves", "   PLAYER {player} has no more valid moves. Game must end. {validMoves}\n", player=player.turnOrder, validMoves=self.validGameMoves)
             self.gameOver = True
 
-        if canAfford == False:
-            return False
+        return canAfford
     
+    def countPlaced(self, player: Agent, cards: list[int]) -> None:
+        """
+        Card counting for every agent when a player spends cards (counts indexed by color), unknown cards are spent once the known ones of a color run out
+        """
+        for agent in self.players:
+            counting = agent.colorCounting[player.turnOrder]
+            for color, count in enumerate(cards):
+                known = min(counting[color], count)
+                counting[color] -= known
+                counting[9] -= count - known
+
     def drawFaceUp(self, player: Agent, cardDistribution: list[str], requery) -> bool:
         """
         Takes the distributions for drawing from the face up cards and performs one draw of the face up card, updating the game to reflect it.
@@ -374,7 +491,7 @@ class Game:
             if isWild and requery:
                 continue
             if color in self.faceUpCards:
-                player.hand_trainCards.append(color)
+                player.hand_trainCards[indexByColor[color]] += 1
                 self.faceUpCards.remove(color)
                 if 2 in self.validGameMoves and len(self.trainCarDeck) > 0:
                     self.faceUpCards.append(self.trainCarDeck.pop())
@@ -382,15 +499,15 @@ class Game:
                         self.validGameMoves.remove(2)
 
                 # Card counting
-                colorIndexes = listColors()
                 for agent in self.players:
-                    agent.colorCounting[player.turnOrder][colorIndexes.index(color)] += 1
+                    agent.colorCounting[player.turnOrder][indexByColor[color]] += 1
 
                 # Logging
-                if self.doLogs:
-                    self.logs = self.logs + [f"   picked up {color} from face up deck.\n"]
+                if self.gameLog.info:
+                    self.gameLog.write(INFO, "faceUp", "   picked up {color} from face up deck.\n", color=color)
 
                 self.colorPicked = color
+                self.trace.append(self.codes.faceUp + indexByColor[color])
                 break
 
         if isWild:
@@ -407,8 +524,8 @@ class Game:
         How it works: player is expected to make the first 3 indexes in actionDistribution as their top choices for cards. The game will take as many destinations available as are in the top 3. If none, it will take only one card - the first most desired one.
         """
 
-        if self.doLogs:
-            self.logs = self.logs + [f"   picked up destination cards: {draw}\n"]
+        if self.gameLog.info:
+            self.gameLog.write(INFO, "destinations", "   picked up destination cards: {draw}\n", draw=draw)
 
         taking = []
         found = None
@@ -430,6 +547,7 @@ class Game:
                 if found:
                     break
         
+        self.trace.append(self.codes.take(taking))
         for x in range(3):
             if x not in taking:
                 self.destinationsDeck.appendleft(draw[x])
@@ -437,112 +555,145 @@ class Game:
                 player.hand_destinationCards.append(draw[x])
                 player.points -= int(draw[x][1])
                 # Logging
-                if self.doLogs:
-                    self.logs = self.logs + [f"   taking {draw[x]}\n"]
+                if self.gameLog.info:
+                    self.gameLog.write(INFO, "taking", "   taking {card}\n", card=draw[x])
 
-    def performAction(self, player: Agent, requery=False, i=None):
+    def askAgent(self, player: Agent, moves: list[int] = None, deal: list[list[str]] = None) -> tuple[int, list[int], list[str]]:
+        """
+        Asks the agent for its turn on the current game state (shown through the cached Observation), optionally requesting one of the given turn actions or a choice from a destination deal
         """
-        Does complete handling of all actions:
+        observation = self.observation
+        observation.player = player.turnOrder
+        observation.requested = moves
+        observation.destinationDeal = deal
+        return player.turn(observation, moves, destCardDeal=deal)
 
-        * Will do valid action checks
+    def dealDestinations(self) -> None:
+        """
+        Reveals the next destination deal (the cards are popped once the player chooses from them), tracing the destination draw.
+        """
+        self.destinationDeal = list(reversed(list(self.destinationsDeck)[-3:]))
+        self.trace.append(self.codes.destinationDraw)
 
-        * Will re-query the agent on follow up decisions
+    def drawFaceDown(self, player: Agent) -> None:
+        """
+        Performs one draw from the face down deck, updating the game to reflect it.
+        """
+        color = self.trainCarDeck.pop()
+        self.colorPicked = color
+        self.trace.append(self.codes.faceDown)
+        player.hand_trainCards[indexByColor[color]] += 1
+        # Card counting
+        for agent in self.players:
+            if agent.turnOrder == player.turnOrder:
+                agent.colorCounting[player.turnOrder][indexByColor[color]] += 1
+            else:
+                agent.colorCounting[player.turnOrder][9] += 1
+        # Recheck for validity
+        if len(self.trainCarDeck) == 0 and 2 in self.validGameMoves:
+            self.validGameMoves.remove(2)
+        # Logging
+        if self.gameLog.info:
+            self.gameLog.write(INFO, "faceDown", "   picked up {color} from face down deck.\n", color=color)
 
-        * Responsible for updating the game state after each player's turn
+    def nextPhase(self, phase: int, action: int, placed: bool = True, wild: bool = False) -> int:
         """
-        
+        The turn phase after an action (turn action index) taken in a phase. placed is False when a wanted route could not be placed (the agent is asked again), wild is True when a face up wild was drawn (which takes the whole turn).
+        """
+        if action == 0:
+            return END_TURN if placed else START_TURN
+        followUp = phase == SECOND_DRAW or phase == DESTINATION_CHOICE
+        if action == 3:
+            return END_TURN if followUp else DESTINATION_CHOICE
+        return END_TURN if followUp or wild else SECOND_DRAW
+
+    def step(self, player: Agent, phase: int = START_TURN, moves: list[int] = None) -> tuple[int, list[int]]:
+        """
+        Runs one phase of a player's turn: asks the agent for a move (one of moves when given, any valid move otherwise) and performs it.
+
+        Returns the next phase and the moves to offer in it.
+        """
+        self.observation.invalidate()
         self.wildFromFaceUp = False
 
         # Debug - stopping game at random point
         if random.randint(0, 25) == 3:
+            self.trace.append(self.codes.stop)
             self.turn -= 1
             self.gameOver = True
-            return
-        
+            return GAME_OVER, None
+
         self.colorPicked = None
-        
-        if i == []:
+
+        if moves == []:
             self.gameOver = True
-            return
+            return GAME_OVER, None
 
         # If not asking for specific move
-        if i == None:
-            action, actionDistribution, cardDistribution = player.turn(self.board, self.faceUpCards, [agent.points for agent in self.players], [len(agent.hand_trainCards) for agent in self.players], [len(agent.hand_destinationCards) for agent in self.players], self.actionMap)
+        if moves == None:
+            action, actionDistribution, cardDistribution = self.askAgent(player)
             while action not in self.validGameMoves:
-                action, actionDistribution, cardDistribution = player.turn(self.board, self.faceUpCards, [agent.points for agent in self.players], [len(agent.hand_trainCards) for agent in self.players], [len(agent.hand_destinationCards) for agent in self.players], self.actionMap)
+                action, actionDistribution, cardDistribution = self.askAgent(player)
+        # Destination cards are dealt before the agent chooses from them
+        elif moves[0] == 3:
+            # Asked to choose without the deal having been revealed first
+            if self.destinationDeal == None:
+                self.dealDestinations()
+            draw = [self.destinationsDeck.pop(), self.destinationsDeck.pop(), self.destinationsDeck.pop()]
+            self.destinationDeal = draw
+            if len(self.destinationsDeck) < 3:
+                self.validGameMoves.remove(3)
+            action, actionDistribution, cardDistribution = self.askAgent(player, moves, draw)
+            self.drawDestinationCards(player, actionDistribution, draw)
+            self.movePerforming = None
+            self.destinationDeal = None
         # If asking for specific move
         else:
-            if i[0] == 3:
-                draw = [self.destinationsDeck.pop(), self.destinationsDeck.pop(), self.destinationsDeck.pop()]
-                self.destinationDeal = draw
-                if len(self.destinationsDeck) < 3:
-                    self.validGameMoves.remove(3)
-                action, actionDistribution, cardDistribution = player.turn(self.board, self.faceUpCards, [agent.points for agent in self.players], [len(agent.hand_trainCards) for agent in self.players], [len(agent.hand_destinationCards) for agent in self.players], self.actionMap, i, destCardDeal=draw)
-                self.drawDestinationCards(player, actionDistribution, draw)
-                self.movePerforming = None
-                self.destinationDeal = None
-            else:
-                action, actionDistribution, cardDistribution = player.turn(self.board, self.faceUpCards, [agent.points for agent in self.players], [len(agent.hand_trainCards) for agent in self.players], [len(agent.hand_destinationCards) for agent in self.players], self.actionMap, i)           
-    
+            action, actionDistribution, cardDistribution = self.askAgent(player, moves)
+
+        placed, wild = True, False
         # Agent wants to place trains
         if action == 0:
-            canPlace = self.placeTrains(player, actionDistribution, cardDistribution)
-            # Train placement is per person, not universal - if it tries and can't, ask for something else.
-            if canPlace == False:
-                valid = deepcopy(self.validGameMoves)
-                valid.remove(0)
-                self.performAction(player, False, valid)
-            else:
-                self.movePerforming = None
+            placed = self.placeTrains(player, actionDistribution, cardDistribution)
         # Agent wants to draw from the face up pile
         elif action == 1:
-            anotherMove = self.drawFaceUp(player, cardDistribution, requery)
-            if anotherMove == False:
-                self.wildFromFaceUp = True
-            if anotherMove and requery == False:
-                # Requery the agent with valid moves 1 and 2 available - drawing from face up or down cards.
-                self.movePerforming = 1
-                x = []
-                if 1 in self.validGameMoves:
-                    x.append(1)
-                if 2 in self.validGameMoves:
-                    x.append(2)
-                self.performAction(player, requery=True, i=x)
-            else:
-                self.movePerforming = None
+            wild = not self.drawFaceUp(player, cardDistribution, phase != START_TURN)
+            self.wildFromFaceUp = wild
         # Agent wants to draw from the face down pile
         elif action == 2:
-            color = self.trainCarDeck.pop()
-            self.colorPicked = color
-            player.hand_trainCards.append(color)
-            # Card counting
-            colorIndexes = listColors()
-            for agent in self.players:
-                if agent.turnOrder == player.turnOrder:
-                    agent.colorCounting[player.turnOrder][colorIndexes.index(color)] += 1
-                else:
-                    agent.colorCounting[player.turnOrder][9] += 1
-            # Recheck for validity
-            if len(self.trainCarDeck) == 0:
-                self.validGameMoves.remove(2)
-            # Logging
-            if self.doLogs:
-                self.logs = self.logs + [f"   picked up {color} from face down deck.\n"]
-            if requery == False:
-                self.movePerforming = 2
-                x = []
-                if 1 in self.validGameMoves:
-                    x.append(1)
-                if 2 in self.validGameMoves:
-                    x.append(2)
-                self.performAction(player, requery=True, i=x)
-            else:
-                self.movePerforming = None
-        # Agent wants to draw new destination cards
-        elif action == 3 and requery == False:
-            self.movePerforming = 3
-            self.destinationDeal = list(reversed(list(self.destinationsDeck)[-3:]))
-            self.performAction(player, i=[3], requery=True)
+            self.drawFaceDown(player)
+        # Agent wants to draw new destination cards, show them the deal
+        elif action == 3 and phase == START_TURN:
+            self.dealDestinations()
+
+        phase = self.nextPhase(phase, action, placed, wild)
+        if phase == START_TURN:
+            # Train placement is per person, not universal - if it tries and can't, ask for something else.
+            return phase, [move for move in self.validGameMoves if move != 0]
+        elif phase == END_TURN:
+            self.movePerforming = None
+            return phase, None
+        self.movePerforming = action
+        if phase == SECOND_DRAW:
+            # Requery the agent with valid moves 1 and 2 available - drawing from face up or down cards.
+            return phase, [move for move in (1, 2) if move in self.validGameMoves]
+        return phase, [3]
+
+    def performAction(self, player: Agent, phase: int = START_TURN, moves: list[int] = None) -> int:
+        """
+        Does complete handling of a player's turn, stepping through its phases until it is over:
+
+        * Will do valid action checks
+
+        * Will re-query the agent on follow up decisions
+
+        * Responsible for updating the game state after each player's turn
+
+        Returns END_TURN, or GAME_OVER when the game stopped during the turn.
+        """
+        while phase != END_TURN and phase != GAME_OVER:
+            phase, moves = self.step(player, phase, moves)
+        return phase
     
     def performActionFrozen(self, player: Agent, action: Action):
         """
@@ -560,66 +711,55 @@ class Game:
         if self.lastTurn and player.turnOrder == self.endedGame:
             self.gameOver = True
 
+        if self.movePerforming == None:
+            phase = START_TURN
+        else:
+            phase = DESTINATION_CHOICE if self.movePerforming == 3 else SECOND_DRAW
+        wild = False
+
         # Wants to place specific route
         if action.action == 0:
-            colorIndexes = listColors()
+            # The first color used is spent as much as possible, the next one fills up the rest
+            weight = action.routeToPlace[2]['weight']
+            cards = [0]*9
+            for color in action.colorsUsed:
+                cards[indexByColor[color]] = min(player.hand_trainCards[indexByColor[color]], weight - sum(cards))
             # color counting
-            for agent in self.players:
-                for color_ in action.colorsUsed:
-                    if agent.colorCounting[player.turnOrder][colorIndexes.index(color_)] != 0:
-                        agent.colorCounting[player.turnOrder][colorIndexes.index(color_)] -= 1
-                    else:
-                        agent.colorCounting[player.turnOrder][9] -= 1
+            self.countPlaced(player, cards)
             # 1. Update the player train count and the player hand
-            player.points += pointsByLength[action.routeToPlace[2]['weight']]
-            player.trainsLeft = player.trainsLeft - action.routeToPlace[2]['weight']
-            for color in action.colorsUsed:
-                player.hand_trainCards.remove(color)
+            player.points += pointsByLength[weight]
+            player.trainsLeft = player.trainsLeft - weight
+            for color, count in enumerate(cards):
+                player.hand_trainCards[color] -= count
             # 2. Update the game board
-            for path in self.board.get_edge_data(action.routeToPlace[0], action.routeToPlace[1]).values():
-                if path['owner'] == '':
-                    path['owner'] = player.turnOrder
-            self.turn += 1
+            self.claimRoute(player, action.routeToPlace[2]['index'])
         elif action.action == 1:
-            if self.movePerforming != None:
-                self.turn += 1
-                self.movePerforming = None
-            else:
-                self.movePerforming = 1
-            self.drawFaceUp(player, action.colorPicked, requery=False)
+            wild = not self.drawFaceUp(player, action.colorPicked, phase == SECOND_DRAW)
         elif action.action == 2:
-            if self.movePerforming != None:
-                self.turn += 1
-                self.movePerforming = None
-            else:
-                self.movePerforming = 2
-            color = self.trainCarDeck.pop()
-            self.colorPicked = color
-            player.hand_trainCards.append(color)
-            # Card counting
-            colorIndexes = listColors()
-            for agent in self.players:
-                if agent.turnOrder == player.turnOrder:
-                    agent.colorCounting[player.turnOrder][colorIndexes.index(color)] += 1
-                else:
-                    agent.colorCounting[player.turnOrder][9] += 1
+            self.drawFaceDown(player)
         elif action.action == 3:
             if action.destinationsPicked == None:
-                self.destinationDeal = list(reversed(list(self.destinationsDeck)[-3:]))
-                self.movePerforming = 3
+                self.dealDestinations()
             else:
+                draw = [self.destinationsDeck.pop(), self.destinationsDeck.pop(), self.destinationsDeck.pop()]
                 drawThese = []
                 for destIndex in action.destinationsPicked:
-                    drawThese.append(self.destinationDeal[destIndex][3])
-                self.drawDestinationCards(player, drawThese, self.destinationDeal)
-                self.movePerforming = None
+                    drawThese.append(draw[destIndex][3])
+                self.drawDestinationCards(player, drawThese, draw)
                 self.destinationDeal = None
-                self.turn += 1
+        self.wildFromFaceUp = wild
+
+        if self.nextPhase(phase, action.action, wild=wild) == END_TURN:
+            self.movePerforming = None
+            self.turn += 1
+        else:
+            self.movePerforming = action.action
 
         # Check if this will be the last turn
         if player.trainsLeft < 3:
             self.endedGame = player.turnOrder
             self.lastTurn = True
+        self.observation.invalidate()
 
     def play(self):
         """
@@ -638,26 +778,24 @@ class Game:
                 if len(self.faceUpCards) == 0 and 1 in self.validGameMoves:
                     self.validGameMoves.remove(1)
 
+                self.trace.append(self.codes.turn + player.turnOrder)
+
                 # Logging
-                if self.doLogs:
-                    if self.debug:
-                        addLogs = [f"\nTURN {self.turn}\n", f"CARDS UP {self.faceUpCards}\n", f"CARDS DOWN {self.trainCarDeck}\n", f"DEST DECK {self.destinationsDeck}\n", f" PLAYER {player.turnOrder} {player.hand_trainCards}, destinations {player.hand_destinationCards}, trains {player.trainsLeft}, points {player.points}\n"] 
-                    else:
-                        addLogs = [f"\nTURN {self.turn}\n", f"CARDS UP {self.faceUpCards}\n", f" PLAYER {player.turnOrder} {player.hand_trainCards}, destinations {player.hand_destinationCards}, trains {player.trainsLeft}, points {player.points}\n"]
-                    self.logs = self.logs + addLogs
+                if self.gameLog.info:
+                    self.logTurn(player)
 
                 # Starting the game (deal out initial destination cards)
                 if self.turn < 1:
 
                     destinationCard_deal = [self.destinationsDeck.pop(), self.destinationsDeck.pop(), self.destinationsDeck.pop()]
                     taken = player.firstTurn(destinationCard_deal)
+                    self.trace += [self.codes.destinationDraw, self.codes.take(taken)]
 
                     # Logging
-                    if self.doLogs == True:
-                        addLogs = [f"   dealt {destinationCard_deal}\n", f"   keeps {player.hand_destinationCards}\n"]
-                        self.logs = self.logs + addLogs
-                        if self.debug == True:
-                            self.logs = self.logs + [f" PLAYER {player.turnOrder} {player.hand_trainCards}, destinations {player.hand_destinationCards}, trains {player.trainsLeft}\n"]
+                    if self.gameLog.info:
+                        self.gameLog.write(INFO, "dealt", "   dealt {deal}\n   keeps {destinations}\n", deal=destinationCard_deal, destinations=player.hand_destinationCards)
+                        if self.gameLog.debug:
+                            self.gameLog.write(DEBUG, "player", " PLAYER {player} {hand}, destinations {destinations}, trains {trains}\n", player=player.turnOrder, hand=handColors(player.hand_trainCards), destinations=player.hand_destinationCards, trains=player.trainsLeft)
 
                     # Sync game object destinations deck with player objects (put the unchosen cards back into the deck)
                     for i in range(3):
@@ -678,8 +816,8 @@ class Game:
                         self.lastTurn = True
                         self.gameOver = True
                         self.endedGame = player.turnOrder
-                        if self.doLogs:
-                            self.logs = self.logs + [f"\nPLAYER {player.turnOrder} INITIATES LAST ROUND\n"]
+                        if self.gameLog.info:
+                            self.gameLog.write(INFO, "lastRound", "\nPLAYER {player} INITIATES LAST ROUND\n", player=player.turnOrder)
                         break
 
                     self.turn += 1
@@ -696,12 +834,9 @@ class Game:
                 playerOrder = [z for z in range(self.endedGame, len(self.players))] + [x for x in range(0, self.endedGame)]
 
             for playerIndex in playerOrder:
-                if self.doLogs:
-                    if self.debug:
-                        addLogs = [f"\nTURN {self.turn}\n", f"CARDS UP {self.faceUpCards}\n", f"CARDS DOWN {self.trainCarDeck}", f" PLAYER {self.players[playerIndex].turnOrder} {self.players[playerIndex].hand_trainCards}, destinations {self.players[playerIndex].hand_destinationCards}, trains {self.players[playerIndex].trainsLeft}, points {self.players[playerIndex].points}\n"]
-                    else:
-                        addLogs = [f"\nTURN {self.turn}\n", f"CARDS UP {self.faceUpCards}\n", f" PLAYER {self.players[playerIndex].turnOrder} {self.players[playerIndex].hand_trainCards}, destinations {self.players[playerIndex].hand_destinationCards}, trains {self.players[playerIndex].trainsLeft}, points {self.players[playerIndex].points}\n"]
-                    self.logs = self.logs + addLogs
+                self.trace.append(self.codes.turn + playerIndex)
+                if self.gameLog.info:
+                    self.logTurn(self.players[playerIndex])
                 self.performAction(self.players[playerIndex])
                 self.turn += 1
         self.gameOver = False
@@ -711,29 +846,28 @@ class Game:
         Called after one/all game(s) have been finished.
         """
 
-        # Route completion testing
-        # 1. Draw a new graph with only the destination cards for that player
-        # 2. Check that graph and tally the points
-        # 3. Do that for all players
+        # Route completion testing - tally the destination cards each player's routes connect
         if self.drawGame:
             pos = nx.spectral_layout(self.board) 
             nx.draw_networkx_nodes(self.board, pos)
             nx.draw_networkx_labels(self.board, pos, font_size=6)
         for player in self.players:
-            edges = [edge for edge in self.board.edges(data=True) if edge[2]['owner'] == player.turnOrder]
-            boardPlaced = nx.MultiGraph(edges)
             for route in player.hand_destinationCards:
-                try: 
-                    completed = nx.has_path(boardPlaced, route[0], route[2])
-                except:
-                    completed = False
-                if completed:
+                if self.isTicketComplete(player, route):
                     player.points += int(route[1])
-                    if self.doLogs:
-                        self.logs = self.logs + [f"PLAYER {player.turnOrder} awarded {route[1]} points for completing {route}\n"]
+                    if self.gameLog.info:
+                        self.gameLog.write(INFO, "ticket", "PLAYER {player} awarded {points} points for completing {card}\n", player=player.turnOrder, points=route[1], card=route)
             if self.drawGame:     
+                edges = [self.mapData.edges[index] for index in bitIndexes(self.ownedRoutes[player.turnOrder])]
                 nx.draw_networkx_edges(self.board, pos, edges, edge_color=colors[player.turnOrder], connectionstyle=f"arc3, rad = 0.{player.turnOrder}", arrows=True)
                 player.color = colors[player.turnOrder]
+
+        # Longest route bonus, every tied player gets it
+        for turnOrder in longestRouteWinners([self.longestRoute(player) for player in self.players]):
+            player = self.players[turnOrder]
+            player.points += longestRouteBonus
+            if self.gameLog.info:
+                self.gameLog.write(INFO, "longestRoute", "PLAYER {player} awarded {points} points for the longest route ({trains} trains)\n", player=player.turnOrder, points=longestRouteBonus, trains=self.longestRoute(player))
         
         if self.drawGame:
             for player in self.players:
@@ -742,9 +876,26 @@ class Game:
                 else:
                     print(f"PLAYER {player.turnOrder + 1} ({player.name}): {player.points}")
 
+    def record(self) -> GameRecord:
+        """
+        The record of the game (seed and trace) for engine.records, from which any of its states can be replayed
+        """
+        return GameRecord(self.mapName, self.names, self.seed, numpy.array(self.trace, dtype=numpy.uint16))
+
+    def logTurn(self, player: Agent) -> None:
+        """
+        Logs the start of a player's turn
+        """
+        self.gameLog.write(INFO, "turn", "\nTURN {turn}\nCARDS UP {faceUp}\n", turn=self.turn, faceUp=self.faceUpCards)
+        if self.gameLog.debug:
+            self.gameLog.write(DEBUG, "decks", "CARDS DOWN {trainCarDeck}\nDEST DECK {destinationDeck}\n", trainCarDeck=self.trainCarDeck, destinationDeck=self.destinationsDeck)
+        self.gameLog.write(INFO, "player", " PLAYER {player} {hand}, destinations {destinations}, trains {trains}, points {points}\n", player=player.turnOrder, hand=handColors(player.hand_trainCards), destinations=player.hand_destinationCards, trains=player.trainsLeft, points=player.points)
+
     def log(self):
-        logs = open("log.txt", "w")
-        logs.writelines(self.logs)
+        """
+        Closes log.txt, which the game log streamed to while playing
+        """
+        self.gameLog.sink.close()
 
 class Input:
     """
@@ -0,0 +1,479 @@
+import numpy
+import networkx as nx
+from collections import deque
+from engine.players import Agent
+from engine.data import MapData, getMap, getPathsAM, bitIndexes, listColors, indexByColor, pointsByLength
+from engine.scoring import CityConnectivity, LongestRoute, buildConnectivity, buildLongestRoute
+from engine.zobrist import getZobristKeys
+
+UNCLAIMED = -1
+"""Route owner value of a route nobody has claimed yet"""
+BLOCKED = -2
+"""Route owner value of a route that is not on the board (the second track of a double route in games of 2-3 players)"""
+WILD = indexByColor['WILD']
+PAYMENTS = 3*WILD + 1
+"""Payment options per route: for each non wild color [color], [color, WILD] and [WILD, color], then [WILD] alone"""
+
+class CompactState:
+    """
+    An array-backed game state meant to replace State for search. Copying it is a handful of flat array copies instead of a deepcopy of the networkx board and agents.
+
+    routeOwner - owner turn order per route index (UNCLAIMED, BLOCKED otherwise)
+
+    ownedRoutes, unclaimedRoutes - the same ownership as bitmasks (one bit per route index) per player and for the routes open on the board
+
+    connectivity, longestRoutes - per player union-find of the cities joined by their routes and longest continuous route cache. These are copy-on-write: apply replaces a player's objects with copies before adding to them, so copies of the state share them
+
+    hands - per player train card counts indexed by engine.data.indexByColor
+
+    trainCarDeck - train card color indexes where the top of the deck is at trainCarCount - 1
+
+    destinationDeck - circular buffer of destination indexes, the bottom at destinationStart and the top destinationCount - 1 places after it
+
+    destinations - per player one-hot of the destination cards held
+
+    faceUpCards - face up card counts indexed by color
+    """
+    __slots__ = ('map', 'mapData', 'names', 'numPlayers', 'routeOwner', 'ownedRoutes', 'unclaimedRoutes', 'connectivity', 'longestRoutes', 'hands', 'trainsLeft', 'points', 'destinations', 'colorCounting', 'faceUpCards', 'trainCarDeck', 'trainCarCount', 'destinationDeck', 'destinationStart', 'destinationCount', 'destinationDeal', 'turn', 'followUpFromMove', 'wildFromFaceUp', 'lastTurn', 'endedGame', 'gameOver', 'colorPicked', 'zobrist')
+
+    def __init__(self, map: str, names: list[str]) -> None:
+        self.map = map
+        self.mapData: MapData = getMap(map)
+        self.names = tuple(names)
+        self.numPlayers = len(names)
+        routeCount = len(self.mapData.weight)
+        destinationCount = len(self.mapData.destinationCards)
+        self.routeOwner = numpy.full(routeCount, UNCLAIMED, dtype=numpy.int8)
+        self.ownedRoutes = [0]*self.numPlayers
+        self.unclaimedRoutes = (1 << routeCount) - 1
+        self.connectivity = [CityConnectivity(len(self.mapData.cities)) for _ in range(self.numPlayers)]
+        self.longestRoutes = [LongestRoute() for _ in range(self.numPlayers)]
+        self.hands = numpy.zeros((self.numPlayers, 9), dtype=numpy.int16)
+        self.trainsLeft = numpy.full(self.numPlayers, 45, dtype=numpy.int16)
+        self.points = numpy.zeros(self.numPlayers, dtype=numpy.int16)
+        self.destinations = numpy.zeros((self.numPlayers, destinationCount), dtype=numpy.uint8)
+        self.colorCounting = numpy.zeros((self.numPlayers, 4, 10), dtype=numpy.int16)
+        self.faceUpCards = numpy.zeros(9, dtype=numpy.int16)
+        self.trainCarDeck = numpy.zeros(110, dtype=numpy.uint8)
+        self.trainCarCount = 0
+        self.destinationDeck = numpy.zeros(destinationCount, dtype=numpy.uint8)
+        self.destinationStart = 0
+        self.destinationCount = 0
+        self.destinationDeal: tuple[int] = None
+        self.turn = 1
+        self.followUpFromMove: int = None
+        self.wildFromFaceUp = False
+        self.lastTurn = False
+        self.endedGame: int = None
+        self.gameOver = False
+        self.colorPicked: str = None
+        self.zobrist: int = None
+        """The Zobrist hash (see engine.zobrist), None until stateHash is first called. apply and undo keep it up to date, code writing the fields directly must reset it to None"""
+
+    @property
+    def currentPlayer(self) -> int:
+        return (self.turn - 1) % self.numPlayers
+
+    def copy(self) -> 'CompactState':
+        """
+        Returns an independent copy of the state, the static map data is shared
+        """
+        new = CompactState.__new__(CompactState)
+        new.map = self.map
+        new.mapData = self.mapData
+        new.names = self.names
+        new.numPlayers = self.numPlayers
+        new.routeOwner = self.routeOwner.copy()
+        new.ownedRoutes = self.ownedRoutes.copy()
+        new.unclaimedRoutes = self.unclaimedRoutes
+        new.connectivity = self.connectivity.copy()
+        new.longestRoutes = self.longestRoutes.copy()
+        new.hands = self.hands.copy()
+        new.trainsLeft = self.trainsLeft.copy()
+        new.points = self.points.copy()
+        new.destinations = self.destinations.copy()
+        new.colorCounting = self.colorCounting.copy()
+        new.faceUpCards = self.faceUpCards.copy()
+        new.trainCarDeck = self.trainCarDeck.copy()
+        new.trainCarCount = self.trainCarCount
+        new.destinationDeck = self.destinationDeck.copy()
+        new.destinationStart = self.destinationStart
+        new.destinationCount = self.destinationCount
+        new.destinationDeal = self.destinationDeal
+        new.turn = self.turn
+        new.followUpFromMove = self.followUpFromMove
+        new.wildFromFaceUp = self.wildFromFaceUp
+        new.lastTurn = self.lastTurn
+        new.endedGame = self.endedGame
+        new.gameOver = self.gameOver
+        new.colorPicked = self.colorPicked
+        new.zobrist = self.zobrist
+        return new
+
+    def stateHash(self) -> int:
+        """
+        The 64-bit Zobrist hash of the state, equal for equal positions however they were reached
+        """
+        if self.zobrist == None:
+            self.zobrist = getZobristKeys(self.map).hashState(self)
+        return self.zobrist
+
+    def __getstate__(self) -> dict:
+        """
+        Pickles the state without the static map data and the connectivity caches, which are rebuilt from the map name and the route bitmasks on unpickling, so that shipping a state to another process stays small
+        """
+        return {name: getattr(self, name) for name in self.__slots__ if name not in ('mapData', 'connectivity', 'longestRoutes')}
+
+    def __setstate__(self, fields: dict) -> None:
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.mapData = getMap(self.map)
+        self.connectivity = [buildConnectivity(self.mapData, bitIndexes(owned)) for owned in self.ownedRoutes]
+        self.longestRoutes = [buildLongestRoute(self.mapData, connectivity, owned) for connectivity, owned in zip(self.connectivity, self.ownedRoutes)]
+
+    # Decks
+
+    def popTrainCar(self) -> int:
+        self.trainCarCount -= 1
+        return int(self.trainCarDeck[self.trainCarCount])
+
+    def popDestination(self) -> int:
+        self.destinationCount -= 1
+        return int(self.destinationDeck[(self.destinationStart + self.destinationCount) % len(self.destinationDeck)])
+
+    def peekDestinations(self, n: int = 3) -> tuple[int]:
+        """
+        The top n destination indexes of the deck, topmost first
+        """
+        size = len(self.destinationDeck)
+        return tuple(int(self.destinationDeck[(self.destinationStart + self.destinationCount - 1 - i) % size]) for i in range(n))
+
+    def returnDestination(self, destination: int) -> None:
+        """
+        Puts a destination card back under the deck
+        """
+        self.destinationStart = (self.destinationStart - 1) % len(self.destinationDeck)
+        self.destinationDeck[self.destinationStart] = destination
+        self.destinationCount += 1
+
+    def trainCarList(self) -> list[str]:
+        colorNames = listColors()
+        return [colorNames[color] for color in self.trainCarDeck[:self.trainCarCount]]
+
+    def destinationList(self) -> list[int]:
+        """
+        The destination deck as indexes from the bottom to the top
+        """
+        size = len(self.destinationDeck)
+        return [int(self.destinationDeck[(self.destinationStart + i) % size]) for i in range(self.destinationCount)]
+
+    # Rules
+
+    def canClaim(self, player: int, route: int) -> bool:
+        """
+        Whether a route is open to a player on the board (not considering the cards or trains needed)
+        """
+        return self.unclaimedRoutes & self.mapData.routeBit[route] != 0 and self.ownedRoutes[player] & self.mapData.siblingBit[route] == 0
+
+    def isTicketComplete(self, player: int, destination: int) -> bool:
+        """
+        Whether the player's routes currently connect the cities of a destination (by index)
+        """
+        return self.connectivity[player].isTicketComplete(self.mapData, destination)
+
+    def completedTickets(self, player: int) -> list[int]:
+        """
+        The destinations (by index) held by the player that are currently complete
+        """
+        return [destination for destination in numpy.flatnonzero(self.destinations[player]) if self.isTicketComplete(player, destination)]
+
+    def longestRoute(self, player: int) -> int:
+        """
+        The length (in trains) of the player's current longest continuous route
+        """
+        return self.longestRoutes[player].longest(self.mapData, self.connectivity[player], self.ownedRoutes[player])
+
+    def payment(self, player: int, route: int, colorsUsed: list[str]) -> numpy.ndarray:
+        """
+        The card counts spent to claim a route given the action color desire. The first color is spent as much as possible, the next one fills up the rest.
+        """
+        weight = self.mapData.weight[route]
+        cards = numpy.zeros(9, dtype=numpy.int16)
+        for color in colorsUsed:
+            color = indexByColor[color]
+            used = min(int(self.hands[player, color]), weight)
+            cards[color] += used
+            weight -= used
+            if weight == 0:
+                break
+        return cards
+
+    def apply(self, action, player: int = None) -> tuple:
+        """
+        Carries out an action (of type engine.build.Action) for the current player, or the given player, in place. This assumes the action given is valid and achievable.
+
+        Returns an undo token, handing it to undo reverts the state exactly. Tokens must be undone in the reverse order they were applied.
+        """
+        player = self.currentPlayer if player == None else player
+        if self.zobrist == None:
+            return self.applyAction(action, player)
+
+        # Rehash only what an action can change: the phase, the decks, the player's hand, the face up cards and the route or destinations taken
+        keys = getZobristKeys(self.map)
+        before = keys.phase(self)
+        hand = self.hands[player].tolist()
+        faceUp = self.faceUpCards.tolist()
+        token = self.applyAction(action, player)
+        zobrist = self.zobrist ^ before ^ keys.phase(self)
+        for color, count in enumerate(self.hands[player].tolist()):
+            if count != hand[color]:
+                zobrist ^= keys.hand[player][color][hand[color]] ^ keys.hand[player][color][count]
+        for color, count in enumerate(self.faceUpCards.tolist()):
+            if count != faceUp[color]:
+                zobrist ^= keys.faceUp[color][faceUp[color]] ^ keys.faceUp[color][count]
+        if token[0] == 0:
+            zobrist ^= keys.route[token[3][0]][player]
+        elif token[0] == 3 and token[3] != None:
+            for destination in token[3][1]:
+                zobrist ^= keys.destination[player][destination]
+        self.zobrist = zobrist
+        return token
+
+    def applyAction(self, action, player: int) -> tuple:
+        """
+        Carries out an action for the player (see apply) without rehashing
+        """
+        saved = (self.turn, self.followUpFromMove, self.wildFromFaceUp, self.lastTurn, self.endedGame, self.gameOver, self.colorPicked, self.destinationDeal, self.trainCarCount, self.destinationStart, self.destinationCount, self.unclaimedRoutes, self.zobrist)
+        self.colorPicked = None
+        self.wildFromFaceUp = False
+
+        if action.action == 0:
+            route = action.routeToPlace[2]['index']
+            weight = self.mapData.weight[route]
+            cards = self.payment(player, route, action.colorsUsed)
+            counted = self.colorCounting[:, player].copy()
+            self.countPlaced(player, cards)
+            self.hands[player] -= cards
+            self.points[player] += pointsByLength[weight]
+            self.trainsLeft[player] -= weight
+            self.routeOwner[route] = player
+            self.ownedRoutes[player] |= self.mapData.routeBit[route]
+            self.unclaimedRoutes &= ~self.mapData.routeBit[route]
+            connectivity = self.connectivity[player]
+            longestRoute = self.longestRoutes[player]
+            self.connectivity[player] = connectivity.copy()
+            self.connectivity[player].addRoute(self.mapData, route)
+            self.longestRoutes[player] = longestRoute.copy()
+            self.longestRoutes[player].addRoute(self.mapData, self.connectivity[player], route)
+            self.endTurn(player)
+            return (0, player, saved, (route, cards, counted, connectivity, longestRoute))
+        elif action.action == 1:
+            color = indexByColor[action.colorPicked[0]]
+            refill = None
+            self.hands[player, color] += 1
+            self.faceUpCards[color] -= 1
+            if self.trainCarCount > 0:
+                refill = self.popTrainCar()
+                self.faceUpCards[refill] += 1
+            self.colorCounting[:, player, color] += 1
+            self.colorPicked = action.colorPicked[0]
+            if self.followUpFromMove != None:
+                self.endTurn(player)
+            elif color == WILD:
+                self.wildFromFaceUp = True
+                self.endTurn(player)
+            else:
+                self.followUpFromMove = 1
+            return (1, player, saved, (color, refill))
+        elif action.action == 2:
+            color = self.popTrainCar()
+            self.hands[player, color] += 1
+            self.colorCounting[:, player, 9] += 1
+            self.colorCounting[player, player, 9] -= 1
+            self.colorCounting[player, player, color] += 1
+            self.colorPicked = listColors()[color]
+            if self.followUpFromMove != None:
+                self.endTurn(player)
+            else:
+                self.followUpFromMove = 2
+            return (2, player, saved, color)
+        elif action.action == 3:
+            if action.destinationsPicked == None:
+                self.destinationDeal = self.peekDestinations()
+                self.followUpFromMove = 3
+                return (3, player, saved, None)
+            deal = [self.popDestination() for _ in range(3)]
+            taken = []
+            for x in range(3):
+                if x in action.destinationsPicked:
+                    taken.append(deal[x])
+                    self.destinations[player, deal[x]] = 1
+                    self.points[player] -= self.mapData.destinationPoints[deal[x]]
+                else:
+                    self.returnDestination(deal[x])
+            self.destinationDeal = None
+            self.endTurn(player)
+            return (3, player, saved, (deal, taken))
+
+    def undo(self, token: tuple) -> None:
+        """
+        Reverts the action that returned the given undo token
+        """
+        action, player, saved, changes = token
+
+        if action == 0:
+            route, cards, counted, connectivity, longestRoute = changes
+            self.connectivity[player] = connectivity
+            self.longestRoutes[player] = longestRoute
+            weight = self.mapData.weight[route]
+            self.routeOwner[route] = UNCLAIMED
+            self.ownedRoutes[player] &= ~self.mapData.routeBit[route]
+            self.trainsLeft[player] += weight
+            self.points[player] -= pointsByLength[weight]
+            self.hands[player] += cards
+            self.colorCounting[:, player] = counted
+        elif action == 1:
+            color, refill = changes
+            self.colorCounting[:, player, color] -= 1
+            if refill != None:
+                self.faceUpCards[refill] -= 1
+            self.faceUpCards[color] += 1
+            self.hands[player, color] -= 1
+        elif action == 2:
+            color = changes
+            self.colorCounting[player, player, color] -= 1
+            self.colorCounting[player, player, 9] += 1
+            self.colorCounting[:, player, 9] -= 1
+            self.hands[player, color] -= 1
+        elif action == 3 and changes != None:
+            deal, taken = changes
+            for destination in taken:
+                self.destinations[player, destination] = 0
+                self.points[player] += self.mapData.destinationPoints[destination]
+            # Returned cards may have been written over the slots the deal was popped from
+            size = len(self.destinationDeck)
+            top = saved[9] + saved[10]
+            for x, destination in enumerate(deal):
+                self.destinationDeck[(top - 1 - x) % size] = destination
+
+        (self.turn, self.followUpFromMove, self.wildFromFaceUp, self.lastTurn, self.endedGame, self.gameOver, self.colorPicked, self.destinationDeal, self.trainCarCount, self.destinationStart, self.destinationCount, self.unclaimedRoutes, self.zobrist) = saved
+
+    def countPlaced(self, player: int, cards: numpy.ndarray) -> None:
+        """
+        Card counting for every agent when a player spends cards, unknown cards are spent once the known ones of a color run out
+        """
+        for color in numpy.flatnonzero(cards):
+            for _ in range(cards[color]):
+                known = self.colorCounting[:, player, color] != 0
+                self.colorCounting[known, player, color] -= 1
+                self.colorCounting[~known, player, 9] -= 1
+
+    def endTurn(self, player: int) -> None:
+        self.followUpFromMove = None
+        self.turn += 1
+        if self.lastTurn == False and self.trainsLeft[player] < 3:
+            self.lastTurn = True
+            self.endedGame = player
+        elif self.lastTurn and self.currentPlayer == self.endedGame:
+            self.gameOver = True
+
+    # Adapters
+
+    @classmethod
+    def fromGame(cls, game) -> 'CompactState':
+        """
+        Builds a CompactState from a Game (live or frozen)
+        """
+        return cls.fromParts(game.mapName, game.board, game.faceUpCards, game.trainCarDeck, game.destinationsDeck, game.players, game.turn, game.movePerforming, game.wildFromFaceUp, game.destinationDeal, game.lastTurn, game.endedGame, game.gameOver)
+
+    @classmethod
+    def fromState(cls, state) -> 'CompactState':
+        """
+        Builds a CompactState from a State
+        """
+        return cls.fromParts(state.map, state.board, state.faceUpCards, state.trainCarDeck, state.destinationDeck, state.players, state.turn, state.followUpFromMove, state.wildFromFaceUp, state.destinationDeal, state.lastTurn, state.endedGame, state.gameOver)
+
+    @classmethod
+    def fromParts(cls, map: str, board: nx.MultiGraph, faceUpCards: list[str], trainCarDeck: deque[str], destinationDeck: deque[list[str]], players: list[Agent], turn: int, followUpFromMove: int, wildFromFaceUp: bool, destinationDeal: list[list], lastTurn: bool, endedGame: int, gameOver: bool) -> 'CompactState':
+        players = sorted(players, key=lambda player: player.turnOrder)
+        state = cls(map, [player.name for player in players])
+
+        state.routeOwner[:] = BLOCKED
+        state.unclaimedRoutes = 0
+        for edge in board.edges(data=True):
+            index = edge[2]['index']
+            if edge[2]['owner'] == '':
+                state.routeOwner[index] = UNCLAIMED
+                state.unclaimedRoutes |= state.mapData.routeBit[index]
+            else:
+                state.routeOwner[index] = edge[2]['owner']
+                state.ownedRoutes[edge[2]['owner']] |= state.mapData.routeBit[index]
+
+        state.connectivity = [buildConnectivity(state.mapData, bitIndexes(owned)) for owned in state.ownedRoutes]
+        state.longestRoutes = [buildLongestRoute(state.mapData, connectivity, owned) for connectivity, owned in zip(state.connectivity, state.ownedRoutes)]
+
+        for player in players:
+            state.hands[player.turnOrder] = player.hand_trainCards
+            for destination in player.hand_destinationCards:
+                state.destinations[player.turnOrder, destination[3]] = 1
+            state.trainsLeft[player.turnOrder] = player.trainsLeft
+            state.points[player.turnOrder] = player.points
+            if len(player.colorCounting) != 0:
+                state.colorCounting[player.turnOrder] = player.colorCounting
+
+        for color in faceUpCards:
+            state.faceUpCards[indexByColor[color]] += 1
+        state.trainCarCount = len(trainCarDeck)
+        state.trainCarDeck[:state.trainCarCount] = [indexByColor[color] for color in trainCarDeck]
+        state.destinationCount = len(destinationDeck)
+        state.destinationDeck[:state.destinationCount] = [destination[3] for destination in destinationDeck]
+        state.destinationDeal = None if destinationDeal == None else tuple(destination[3] for destination in destinationDeal)
+
+        state.turn = turn
+        state.followUpFromMove = followUpFromMove
+        state.wildFromFaceUp = wildFromFaceUp
+        state.lastTurn = lastTurn == True
+        state.endedGame = endedGame if lastTurn else None
+        state.gameOver = gameOver
+        return state
+
+    def toState(self):
+        """
+        Builds the equivalent (deepcopied) State, used to hand a CompactState to code written against State such as Game.setGame
+        """
+        from engine.build import State
+
+        board = nx.MultiGraph()
+        for route, edge in enumerate(self.mapData.edges):
+            if self.routeOwner[route] != BLOCKED:
+                data = dict(edge[2])
+                data['owner'] = '' if self.routeOwner[route] == UNCLAIMED else int(self.routeOwner[route])
+                board.add_edge(edge[0], edge[1], **data)
+
+        colorNames = listColors()
+        players = []
+        for turnOrder, name in enumerate(self.names):
+            agent = Agent(name)
+            agent.turnOrder = turnOrder
+            agent.hand_trainCards = self.hands[turnOrder].tolist()
+            agent.hand_destinationCards = [list(self.mapData.destinationCards[destination]) for destination in numpy.flatnonzero(self.destinations[turnOrder])]
+            agent.trainsLeft = int(self.trainsLeft[turnOrder])
+            agent.points = int(self.points[turnOrder])
+            agent.colorCounting = self.colorCounting[turnOrder].tolist()
+            players.append(agent)
+
+        faceUpCards = [colorNames[color] for color in range(9) for _ in range(self.faceUpCards[color])]
+        trainCarDeck = deque(self.trainCarList())
+        destinationDeck = deque(list(self.mapData.destinationCards[destination]) for destination in self.destinationList())
+        destinationDeal = None if self.destinationDeal == None else [list(self.mapData.destinationCards[destination]) for destination in self.destinationDeal]
+
+        validMoves = [0]
+        if len(faceUpCards) > 0:
+            validMoves.append(1)
+        if len(trainCarDeck) > 0:
+            validMoves.append(2)
+        if len(destinationDeck) >= 3:
+            validMoves.append(3)
+        actionMap = { 0: list(getPathsAM(self.map)), 1: faceUpCards, 2: trainCarDeck, 3: [list(card) for card in self.mapData.destinationCards] }
+
+        return State(board, faceUpCards, trainCarDeck, destinationDeck, players, self.turn, self.map, self.followUpFromMove, self.wildFromFaceUp, destinationDeal, validMoves, actionMap, self.lastTurn, self.endedGame, self.gameOver)
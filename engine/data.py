@@ -1,49 +1,168 @@
+import os
 import re
+import numpy
 
 pointsByLength = {1: 1, 2: 2, 3: 4, 4: 7, 5: 10, 6: 15}
+longestRouteBonus = 10
 colors = {0: 'red', 1: 'blue', 2: 'orange', 3: 'green'}
 indexByColor = {'PINK': 0, 'WHITE': 1, 'BLUE': 2, 'YELLOW': 3, 'ORANGE': 4, 'BLACK': 5, 'RED': 6, 'GREEN': 7, 'WILD': 8}
+GRAY = -1
+"""Color index of a gray route in MapData"""
+
+class MapData:
+    """
+    The immutable, precomputed tables of one map. Every table is indexed by route index, destination index or city id.
+
+    routes - (routes, 5) int16 array of [city1 id, city2 id, weight, color index (GRAY for gray), index of the other track of a double route (-1 if single)]
+
+    destinations - (destinations, 3) int16 array of [city1 id, city2 id, points]
+
+    cities - the city names by city id
+
+    The same columns are also kept as tuples (weight, color, sibling, ...) since indexing tuples is much faster than indexing numpy arrays one item at a time.
+    """
+    def __init__(self, name: str, cities: numpy.ndarray, routes: numpy.ndarray, destinations: numpy.ndarray) -> None:
+        self.name = name
+        self.cities = tuple(str(city) for city in cities)
+        self.cityIds = { city: cityId for cityId, city in enumerate(self.cities) }
+        self.routes = routes
+        self.destinations = destinations
+
+        colorNames = listColors()
+        self.routeCity1 = tuple(int(city) for city in routes[:, 0])
+        self.routeCity2 = tuple(int(city) for city in routes[:, 1])
+        self.weight = tuple(int(weight) for weight in routes[:, 2])
+        self.color = tuple(int(color) for color in routes[:, 3])
+        self.colorName = tuple('GRAY' if color == GRAY else colorNames[color] for color in self.color)
+        self.sibling = tuple(int(sibling) for sibling in routes[:, 4])
+        self.routeBit = tuple(1 << i for i in range(len(self.weight)))
+        """The bit of each route in route bitmasks"""
+        self.siblingBit = tuple(0 if sibling == -1 else 1 << sibling for sibling in self.sibling)
+        """The bit of the other track of each double route in route bitmasks, 0 if the route is single"""
+        self.city1 = tuple(self.cities[city] for city in self.routeCity1)
+        self.city2 = tuple(self.cities[city] for city in self.routeCity2)
+        self.paths = tuple((self.city1[i], str(self.weight[i]), self.colorName[i], self.city2[i], i) for i in range(len(self.weight)))
+        """Routes as (city1, length, color, city2, index) in the format of getPaths"""
+        self.edges = tuple((self.city1[i], self.city2[i], {'weight': self.weight[i], 'color': self.colorName[i], 'owner': '', 'index': i}) for i in range(len(self.weight)))
+        """networkx style (city1, city2, data) tuples, used as Action.routeToPlace"""
+
+        self.destinationCity1 = tuple(int(city) for city in destinations[:, 0])
+        self.destinationCity2 = tuple(int(city) for city in destinations[:, 1])
+        self.destinationPoints = tuple(int(points) for points in destinations[:, 2])
+        self.destinationCards = tuple((self.cities[self.destinationCity1[i]], str(self.destinationPoints[i]), self.cities[self.destinationCity2[i]], i) for i in range(len(self.destinationPoints)))
+        """Destinations as (city1, points, city2, index) in the format of getDestinationCards"""
+
+_maps: dict[str, MapData] = {}
+
+def getMap(map: str) -> MapData:
+    """
+    Takes a map name and returns its MapData. The map is loaded once per process, from its bundle if one was saved with saveMapBundle and is up to date, otherwise by parsing the map text files.
+    """
+    if map not in _maps:
+        if bundleIsCurrent(map):
+            _maps[map] = loadMapBundle(map)
+        else:
+            _maps[map] = parseMap(map)
+    return _maps[map]
+
+def parseMap(map: str) -> MapData:
+    """
+    Parses the map text files into MapData
+    """
+    cityIds = {}
+    def cityId(city: str) -> int:
+        if city not in cityIds:
+            cityIds[city] = len(cityIds)
+        return cityIds[city]
+
+    routes = []
+    firstTrack = {}
+    for index, path in enumerate(open(f"engine/{map}_paths.txt").readlines()):
+        data = re.search('(^\D+)(\d)\W+(\w+)\W+(.+)', path)
+        city1, city2 = cityId(data.group(1).strip()), cityId(data.group(4).strip())
+        color = data.group(3).strip()
+        routes.append([city1, city2, int(data.group(2).strip()), GRAY if color == 'GRAY' else indexByColor[color], -1])
+        # Double routes: link both tracks to each other
+        cities = frozenset((city1, city2))
+        if cities in firstTrack:
+            routes[index][4] = firstTrack[cities]
+            routes[firstTrack[cities]][4] = index
+        else:
+            firstTrack[cities] = index
+
+    destinations = []
+    for card in open(f"engine/{map}_destinations.txt").readlines():
+        data = re.search('(^\D+)(\d+)\s(.+)', card)
+        destinations.append([cityId(data.group(1).strip()), cityId(data.group(3).strip()), int(data.group(2).strip())])
+
+    return MapData(map, numpy.array(list(cityIds)), numpy.array(routes, dtype=numpy.int16), numpy.array(destinations, dtype=numpy.int16))
+
+def bundlePath(map: str) -> str:
+    return f"engine/{map}_bundle"
+
+def bundleIsCurrent(map: str) -> bool:
+    """
+    Whether a saved bundle of the map exists and is newer than the map text files
+    """
+    bundle = os.path.join(bundlePath(map), "routes.npy")
+    if not os.path.exists(bundle):
+        return False
+    return os.path.getmtime(bundle) >= max(os.path.getmtime(f"engine/{map}_paths.txt"), os.path.getmtime(f"engine/{map}_destinations.txt"))
+
+def saveMapBundle(map: str) -> None:
+    """
+    Saves the precompiled tables of a map as .npy files (engine/{map}_bundle/) so that later processes memory-map them instead of parsing the text files
+    """
+    data = parseMap(map)
+    os.makedirs(bundlePath(map), exist_ok=True)
+    numpy.save(os.path.join(bundlePath(map), "cities.npy"), numpy.array(data.cities))
+    numpy.save(os.path.join(bundlePath(map), "routes.npy"), data.routes)
+    numpy.save(os.path.join(bundlePath(map), "destinations.npy"), data.destinations)
+
+def loadMapBundle(map: str) -> MapData:
+    """
+    Memory-maps a bundle saved by saveMapBundle into MapData
+    """
+    cities = numpy.load(os.path.join(bundlePath(map), "cities.npy"), mmap_mode='r')
+    routes = numpy.load(os.path.join(bundlePath(map), "routes.npy"), mmap_mode='r')
+    destinations = numpy.load(os.path.join(bundlePath(map), "destinations.npy"), mmap_mode='r')
+    return MapData(map, cities, routes, destinations)
 
 def getPaths(map: str) -> list[list[str]]:
     """
     Takes a map name and returns a list of paths between cities where each item is an array [city1, length, color, city2] as strings
     """
-    lines = open(f"engine/{map}_paths.txt").readlines()
-    paths = []
-    i = 0
-    for path in lines:
-        data = re.search('(^\D+)(\d)\W+(\w+)\W+(.+)', path)
-        paths.append([data.group(1).strip(), data.group(2).strip(), data.group(3).strip(), data.group(4).strip(), i])
-        i += 1
-    return paths
+    return [list(path) for path in getMap(map).paths]
 
 def getPathsAM(map: str) -> list[list[str]]:
     """
     Takes a map name and returns a list of paths between cities where each item is an array [city1, length, color, city2] as strings including the edge data (for action map)
     """
-    lines = open(f"engine/{map}_paths.txt").readlines()
-    paths = []
-    i = 0
-    for path in lines:
-        data = re.search('(^\D+)(\d)\W+(\w+)\W+(.+)', path)
-        weight = int(data.group(2).strip())
-        paths.append([data.group(1).strip(), data.group(4).strip(), 0, {'weight': weight, 'color': data.group(3).strip(), 'owner': '', 'index': i}])
-        i += 1
-    return paths
+    return [[edge[0], edge[1], 0, dict(edge[2])] for edge in getMap(map).edges]
 
 def getDestinationCards(map: str) -> list[list[str]]:
     """
     Takes a map name and returns a list of paths between cities where each item is an array [city1, points, city2] as strings
     """
-    lines = open(f"engine/{map}_destinations.txt").readlines()
-    cards = []
-    i = 0
-    for card in lines:
-        data = re.search('(^\D+)(\d+)\s(.+)', card)
-        cards.append([data.group(1).strip(), data.group(2).strip(), data.group(3).strip(), i])
-        i += 1
-    
-    return cards
+    return [list(card) for card in getMap(map).destinationCards]
+
+def bitIndexes(mask: int) -> list[int]:
+    """
+    The indexes of the set bits of a bitmask (for example the route indexes in a route ownership mask), lowest first
+    """
+    indexes = []
+    while mask:
+        low = mask & -mask
+        indexes.append(low.bit_length() - 1)
+        mask ^= low
+    return indexes
+
+def handColors(hand: list[int]) -> list[str]:
+    """
+    Expands a hand of train card counts (indexed by indexByColor) into the color names of its cards, for logging
+    """
+    colorNames = listColors()
+    return [colorNames[color] for color, count in enumerate(hand) for _ in range(count)]
 
 def listColors() -> list[str]:
     return ['PINK', 'WHITE', 'BLUE', 'YELLOW', 'ORANGE', 'BLACK', 'RED', 'GREEN', 'WILD']
@@ -55,4 +174,4 @@ def product(*args: int) -> float:
     p = 1
     for arg in args:
         p *= arg
-    return p
\ No newline at end of file
+    return p
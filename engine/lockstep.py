@@ -0,0 +1,419 @@
+import numpy
+from engine.compact import UNCLAIMED, BLOCKED, WILD
+from engine.scoring import longestTrail
+from engine.data import MapData, getMap, pointsByLength, longestRouteBonus
+
+FACE_UP, FACE_DOWN, DESTINATIONS, DEAL = 1, 2, 3, 4
+"""Lockstep turn branches, DEAL is a destination draw Game.performAction deals before asking the agent"""
+
+class LockstepGames:
+    """
+    A batch of Ticket to Ride games between engine.players.Random agents, advanced one turn at a time in lockstep with every game as a row of numpy arrays.
+
+    Random agents only pick uniformly among what is valid, so their choices are drawn directly from the arrays: the first affordable route of a shuffled action distribution is a uniformly random affordable route, the first face up color of a shuffled card distribution is a uniformly random color showing, and so on. The rules are the ones of Game.play and Game.performAction (including the debug stop, see stopChance), so the averages agree with engine.run.play.
+
+    routeOwner - (games, routes) owner per route index (UNCLAIMED, BLOCKED for the second track of double routes in games of 2-3 players)
+
+    hands - (games, players, 9) train card counts indexed by engine.data.indexByColor
+
+    trainCarDeck - (games, 110) train card color indexes where the top of each deck is at trainCarCount - 1
+
+    destinationDeck - (games, destinations) circular buffers of destination indexes, the bottom at destinationStart and the top destinationCount - 1 places after it
+
+    destinations - (games, players, destinations) destination cards held
+
+    validMoves - (games, 4) the game's valid turn actions, a move is never valid again once removed (like Game.validGameMoves)
+    """
+    def __init__(self, mapData: MapData, numPlayers: int, games: int, rng: numpy.random.Generator, stopChance: float = 1/26) -> None:
+        """
+        stopChance - chance of the debug stop at the start of every Game.performAction call (1 in 26 in the engine), 0 plays every game to its end
+        """
+        self.mapData = mapData
+        self.numPlayers = numPlayers
+        self.games = games
+        self.rng = rng
+        self.stopChance = stopChance
+        routeCount = len(mapData.weight)
+        destinationCount = len(mapData.destinationCards)
+
+        # Static tables
+        self.weight = mapData.routes[:, 2].astype(numpy.int16)
+        sibling = numpy.array(mapData.sibling)
+        self.doubleRoutes = numpy.flatnonzero(sibling >= 0)
+        """Routes with another track, and their other tracks in siblings"""
+        self.siblings = sibling[self.doubleRoutes]
+        self.paySlot = numpy.where(numpy.array(mapData.color) == -1, WILD, numpy.array(mapData.color))
+        """Payment table slot per route: its color, or WILD for gray routes"""
+        self.routePoints = numpy.array([pointsByLength[weight] for weight in mapData.weight], dtype=numpy.int32)
+        self.destinationPoints = numpy.array(mapData.destinationPoints, dtype=numpy.int32)
+        self.weights = numpy.arange(1, max(pointsByLength) + 1, dtype=numpy.int16)
+
+        # Board
+        self.routeOwner = numpy.full((games, routeCount), UNCLAIMED, dtype=numpy.int8)
+        if numPlayers < 4:
+            # Only the first track of double routes is claimable
+            self.routeOwner[:, self.doubleRoutes[self.siblings < self.doubleRoutes]] = BLOCKED
+        self.hands = numpy.zeros((games, numPlayers, 9), dtype=numpy.int16)
+        self.trainsLeft = numpy.full((games, numPlayers), 45, dtype=numpy.int16)
+        self.points = numpy.zeros((games, numPlayers), dtype=numpy.int32)
+        self.destinations = numpy.zeros((games, numPlayers, destinationCount), dtype=bool)
+        self.validMoves = numpy.ones((games, 4), dtype=bool)
+
+        # Decks
+        deck = numpy.repeat(numpy.arange(9, dtype=numpy.uint8), [12]*8 + [14])
+        self.trainCarDeck = rng.permuted(numpy.tile(deck, (games, 1)), axis=1)
+        self.trainCarCount = numpy.full(games, len(deck), dtype=numpy.int16)
+        self.faceUpCards = numpy.zeros((games, 9), dtype=numpy.int16)
+        self.destinationDeck = rng.permuted(numpy.tile(numpy.arange(destinationCount, dtype=numpy.uint8), (games, 1)), axis=1)
+        self.destinationStart = numpy.zeros(games, dtype=numpy.int16)
+        self.destinationCount = numpy.full(games, destinationCount, dtype=numpy.int16)
+
+        # Turns
+        self.seats = rng.permuted(numpy.tile(numpy.arange(numPlayers), (games, 1)), axis=1)
+        """Agent (by position in the list of agents) in each seat (turn order), as Game shuffles its players"""
+        self.player = numpy.zeros(games, dtype=numpy.int8)
+        """Turn order of the player to move per game"""
+        self.finalTurns = numpy.zeros(games, dtype=numpy.int8)
+        """Turns left in the last round, 0 before it starts"""
+        self.active = numpy.ones(games, dtype=bool)
+
+    # Decks
+
+    def popTrainCars(self, games: numpy.ndarray) -> numpy.ndarray:
+        self.trainCarCount[games] -= 1
+        return self.trainCarDeck[games, self.trainCarCount[games]]
+
+    def popDestinations(self, games: numpy.ndarray) -> numpy.ndarray:
+        self.destinationCount[games] -= 1
+        return self.destinationDeck[games, (self.destinationStart[games] + self.destinationCount[games]) % self.destinationDeck.shape[1]]
+
+    def returnDestinations(self, games: numpy.ndarray, destinations: numpy.ndarray) -> None:
+        """
+        Puts destination cards back under the decks of the games
+        """
+        self.destinationStart[games] = (self.destinationStart[games] - 1) % self.destinationDeck.shape[1]
+        self.destinationDeck[games, self.destinationStart[games]] = destinations
+        self.destinationCount[games] += 1
+
+    # Choices
+
+    def pick(self, allowed: numpy.ndarray) -> numpy.ndarray:
+        """
+        A uniformly random allowed column per row of a boolean matrix, -1 for rows where nothing is allowed
+        """
+        counts = allowed.cumsum(axis=1, dtype=numpy.int16)
+        chosen = (self.rng.random(len(allowed)) * counts[:, -1]).astype(numpy.int16)
+        picked = (counts > chosen[:, None]).argmax(axis=1)
+        picked[counts[:, -1] == 0] = -1
+        return picked
+
+    def stops(self, n: int) -> numpy.ndarray:
+        """
+        Which of n Game.performAction calls hit the debug stop
+        """
+        return self.rng.random(n) < self.stopChance
+
+    # Game flow
+
+    def deal(self) -> None:
+        """
+        Game.build and Game.init: the face up cards, 4 train cards per player, then each player keeps 2 or 3 of 3 destination cards
+        """
+        every = numpy.arange(self.games)
+        for _ in range(5):
+            numpy.add.at(self.faceUpCards, (every, self.popTrainCars(every)), 1)
+        for player in range(self.numPlayers):
+            for _ in range(4):
+                numpy.add.at(self.hands, (every, player, self.popTrainCars(every)), 1)
+        players = numpy.zeros(self.games, dtype=numpy.int8)
+        for player in range(self.numPlayers):
+            players[:] = player
+            deal = numpy.stack([self.popDestinations(every) for _ in range(3)], axis=1)
+            # sample([0, 1, 2], randint(2, 3))
+            keep = numpy.ones((self.games, 3), dtype=bool)
+            two = self.rng.random(self.games) < 0.5
+            keep[two, self.rng.integers(0, 3, two.sum())] = False
+            self.takeDestinations(every, players, deal, keep)
+
+    def takeDestinations(self, games: numpy.ndarray, players: numpy.ndarray, deal: numpy.ndarray, keep: numpy.ndarray) -> None:
+        """
+        The players keep the kept cards of (games, 3) destination deals (paying their points until completed), the others go back under the deck
+        """
+        for x in range(3):
+            kept = keep[:, x]
+            self.destinations[games[kept], players[kept], deal[kept, x]] = True
+            self.points[games[kept], players[kept]] -= self.destinationPoints[deal[kept, x]]
+            self.returnDestinations(games[~kept], deal[~kept, x])
+
+    def checkValidMoves(self, games: numpy.ndarray) -> None:
+        """
+        The validity checks at the start of every turn of Game.play
+        """
+        self.validMoves[games, DESTINATIONS] &= self.destinationCount[games] >= 3
+        self.validMoves[games, FACE_DOWN] &= self.trainCarCount[games] > 0
+        self.validMoves[games, FACE_UP] &= self.faceUpCards[games].sum(axis=1) > 0
+
+    def placeTrains(self, games: numpy.ndarray, players: numpy.ndarray) -> numpy.ndarray:
+        """
+        Game.placeTrains for Random agents: claims a uniformly random route the players can claim and pay for, paid the way Game.placeTrains pays for it under a random card distribution. Returns which players placed trains.
+        """
+        hands = self.hands[games, players]
+        wilds = hands[:, WILD, None]
+        # A shuffled card distribution, reversed so the least desired color comes first
+        least = self.rng.random((len(games), 9)).argsort(axis=1)[:, ::-1]
+        counts = numpy.take_along_axis(hands, least, axis=1)
+        wildAt = (least == WILD).argmax(axis=1)[:, None]
+        w = self.weights[None, :, None]
+
+        # Affordable (per color x weight, WILD standing for gray): colored routes with enough of the color or of wilds. Gray routes with, from least desired, enough of a color before WILD, or wilds topped up by a color after it
+        canPay = numpy.empty((len(games), 9, len(self.weights)), dtype=bool)
+        canPay[:, :WILD] = (hands[:, :WILD, None] >= self.weights) | (wilds[:, :, None] >= self.weights)
+        position = numpy.arange(9)
+        alone = ((counts[:, None, :] >= w) & (position < wildAt)[:, None, :]).any(axis=2)
+        toppedUp = (((counts + wilds)[:, None, :] >= w) & (position > wildAt)[:, None, :]).any(axis=2)
+        canPay[:, WILD] = alone | toppedUp
+
+        # Pick a route
+        owners = self.routeOwner[games]
+        open = (owners == UNCLAIMED) & (self.weight <= self.trainsLeft[games, players][:, None])
+        open[:, self.doubleRoutes] &= owners[:, self.siblings] != players[:, None]
+        open &= canPay[:, self.paySlot, self.weight - 1]
+        route = self.pick(open)
+        placed = route >= 0
+        games, players, route = games[placed], players[placed], route[placed]
+        hands, least, counts, wildAt = hands[placed], least[placed], counts[placed], wildAt[placed]
+        weight = self.weight[route]
+        slot = self.paySlot[route]
+        cards = numpy.zeros((len(games), 9), dtype=numpy.int16)
+
+        # Colored routes: the color first when wilds are more desired, wilds first otherwise, whichever covers the route
+        colored = numpy.flatnonzero(slot != WILD)
+        color, needed = slot[colored], weight[colored]
+        colorFirst = (least[colored] == color[:, None]).argmax(axis=1) < wildAt[colored, 0]
+        enoughColor = hands[colored, color] >= needed
+        useColor = enoughColor & (colorFirst | (hands[colored, WILD] < needed))
+        cards[colored, numpy.where(useColor, color, WILD)] = needed
+
+        # Gray routes: the first color covering it before WILD, else all wilds (plus the first color after WILD making up the rest)
+        gray = numpy.flatnonzero(slot == WILD)
+        needed = weight[gray, None]
+        before = (counts[gray] >= needed) & (position < wildAt[gray])
+        after = (counts[gray] + hands[gray, WILD, None] >= needed) & (position > wildAt[gray])
+        useColor = before.any(axis=1)
+        first = numpy.where(useColor, before.argmax(axis=1), after.argmax(axis=1))
+        color = least[gray, first]
+        topUp = ~useColor & (hands[gray, WILD] < needed[:, 0])
+        cards[gray, WILD] = numpy.where(useColor, 0, numpy.minimum(hands[gray, WILD], needed[:, 0]))
+        cards[gray[useColor | topUp], color[useColor | topUp]] = numpy.where(useColor, needed[:, 0], needed[:, 0] - hands[gray, WILD])[useColor | topUp]
+
+        self.hands[games, players] -= cards
+        self.points[games, players] += self.routePoints[route]
+        self.trainsLeft[games, players] -= weight
+        self.routeOwner[games, route] = players
+        return placed
+
+    def drawFaceUp(self, games: numpy.ndarray, players: numpy.ndarray, wild: bool) -> numpy.ndarray:
+        """
+        Game.drawFaceUp for Random agents: takes a uniformly random color showing (never WILD unless wild) and refills from the deck. Returns the colors taken, -1 where nothing could be taken.
+        """
+        showing = self.faceUpCards[games] > 0
+        if not wild:
+            showing[:, WILD] = False
+        color = self.pick(showing)
+        took = color >= 0
+        games, players, color = games[took], players[took], color[took]
+        self.hands[games, players, color] += 1
+        self.faceUpCards[games, color] -= 1
+        refill = self.validMoves[games, FACE_DOWN] & (self.trainCarCount[games] > 0)
+        games = games[refill]
+        self.faceUpCards[games, self.popTrainCars(games)] += 1
+        self.validMoves[games, FACE_DOWN] &= self.trainCarCount[games] > 0
+        picked = numpy.full(len(took), -1)
+        picked[took] = color
+        return picked
+
+    def drawFaceDown(self, games: numpy.ndarray, players: numpy.ndarray) -> None:
+        self.hands[games, players, self.popTrainCars(games)] += 1
+        self.validMoves[games, FACE_DOWN] &= self.trainCarCount[games] > 0
+
+    def drawDestinationCards(self, games: numpy.ndarray, players: numpy.ndarray) -> None:
+        """
+        Game.drawDestinationCards for Random agents: of a shuffled distribution of every destination, the players keep the dealt cards in its top 3, or the first dealt card in it if none are
+        """
+        deal = numpy.stack([self.popDestinations(games) for _ in range(3)], axis=1)
+        self.validMoves[games, DESTINATIONS] &= self.destinationCount[games] >= 3
+        # Positions of the 3 dealt cards in the shuffled distribution
+        keys = self.rng.random((len(games), self.destinationDeck.shape[1]))
+        position = (keys[:, None, :] < keys[:, :3, None]).sum(axis=2)
+        keep = position < 3
+        first = ~keep.any(axis=1)
+        keep[first, position[first].argmin(axis=1)] = True
+        self.takeDestinations(games, players, deal, keep)
+
+    def turn(self, games: numpy.ndarray, players: numpy.ndarray) -> numpy.ndarray:
+        """
+        One Game.performAction per game (a whole turn with its follow up requests). Returns which games it set over.
+        """
+        n = len(games)
+        over = self.stops(n)
+        action = self.pick(self.validMoves[games])
+        action[over] = -1
+
+        # Placing trains, if the route picked can not be paid the agent is asked again for another action
+        placing = numpy.flatnonzero(action == 0)
+        failed = placing[~self.placeTrains(games[placing], players[placing])]
+        others = self.validMoves[games[failed], FACE_UP:]
+        stuck = ~others.any(axis=1)
+        over[failed[stuck]] = True
+        action[failed] = -1
+        failed, others = failed[~stuck], others[~stuck]
+        stopped = self.stops(len(failed))
+        over[failed[stopped]] = True
+        failed, others = failed[~stopped], others[~stopped]
+        # An action list of only destinations is dealt right away
+        action[failed] = numpy.where(others[:, 2] & ~others[:, 0] & ~others[:, 1], DEAL, self.pick(others) + FACE_UP)
+
+        # Drawing train cards, a second draw follows unless a face up wild was taken
+        faceUp = numpy.flatnonzero(action == FACE_UP)
+        faceDown = numpy.flatnonzero(action == FACE_DOWN)
+        picked = self.drawFaceUp(games[faceUp], players[faceUp], True)
+        self.drawFaceDown(games[faceDown], players[faceDown])
+        second = numpy.concatenate([faceUp[picked != WILD], faceDown])
+        stopped = self.stops(len(second))
+        over[second[stopped]] = True
+        second = second[~stopped]
+        draws = self.pick(self.validMoves[games[second], FACE_UP:DESTINATIONS])
+        over[second[draws < 0]] = True
+        faceUp, faceDown = second[draws == 0], second[draws == 1]
+        self.drawFaceUp(games[faceUp], players[faceUp], False)
+        self.drawFaceDown(games[faceDown], players[faceDown])
+
+        # Destination cards are dealt right away from an action list of only destinations, but the agent still asks for them again afterwards (Game.performAction raises if the deck ran short by then, those games skip the second deal)
+        dealt = numpy.flatnonzero(action == DEAL)
+        self.drawDestinationCards(games[dealt], players[dealt])
+        dealt = dealt[self.validMoves[games[dealt], DESTINATIONS]]
+        # Drawing destination cards is requested again before the deal
+        requested = numpy.concatenate([numpy.flatnonzero(action == DESTINATIONS), dealt])
+        stopped = self.stops(len(requested))
+        over[requested[stopped]] = True
+        requested = requested[~stopped]
+        self.drawDestinationCards(games[requested], players[requested])
+        return over
+
+    def play(self) -> None:
+        """
+        Plays every game out (Game.play)
+        """
+        self.deal()
+        while self.active.any():
+            games = numpy.flatnonzero(self.active)
+            players = self.player[games].astype(numpy.int64)
+            self.checkValidMoves(games)
+            playing = self.validMoves[games].any(axis=1)
+            over = numpy.ones(len(games), dtype=bool)
+            over[playing] = self.turn(games[playing], players[playing])
+
+            # Before the last round: a game set over ends, a player under 3 trains starts the last round
+            main = self.finalTurns[games] == 0
+            self.active[games[main & over]] = False
+            ended = main & ~over & (self.trainsLeft[games, players] < 3)
+            # The last round gives every player (the one who ended the game included) one more turn, in the order of Game.play
+            ender = players[ended]
+            self.player[games[ended]] = numpy.where(ender == self.numPlayers - 1, 0, numpy.where(ender == 0, 1, ender))
+            self.finalTurns[games[ended]] = self.numPlayers
+            following = main & ~over & ~ended
+            self.player[games[following]] = (players[following] + 1) % self.numPlayers
+
+            # In the last round nothing ends the game early
+            final = games[~main]
+            self.finalTurns[final] -= 1
+            self.player[final] = (self.player[final] + 1) % self.numPlayers
+            self.active[final[self.finalTurns[final] == 0]] = False
+
+    def cityLabels(self) -> numpy.ndarray:
+        """
+        (games, players, cities) the smallest city id each city is connected to by the player's routes, so two cities are connected when their labels match
+        """
+        cities = len(self.mapData.cities)
+        labels = numpy.tile(numpy.arange(cities, dtype=numpy.int16), (self.games, self.numPlayers, 1))
+        games, routes = numpy.nonzero(self.routeOwner >= 0)
+        players = self.routeOwner[games, routes]
+        city1, city2 = self.mapData.routes[routes, 0], self.mapData.routes[routes, 1]
+        while True:
+            lowest = numpy.minimum(labels[games, players, city1], labels[games, players, city2])
+            before = labels.copy()
+            numpy.minimum.at(labels, (games, players, city1), lowest)
+            numpy.minimum.at(labels, (games, players, city2), lowest)
+            # Pointer jumping
+            labels = numpy.take_along_axis(labels, labels.astype(numpy.int64), axis=2)
+            if (labels == before).all():
+                return labels
+
+    def endGame(self) -> None:
+        """
+        Game.endGame: completed destination tickets give their points back, the longest route bonus goes to every tied player
+        """
+        labels = self.cityLabels()
+        city1 = labels[:, :, self.mapData.destinations[:, 0]]
+        city2 = labels[:, :, self.mapData.destinations[:, 1]]
+        self.points += ((city1 == city2) & self.destinations).astype(numpy.int32) @ self.destinationPoints
+
+        lengths = self.longestRoutes(labels)
+        best = lengths.max(axis=1, keepdims=True)
+        self.points += numpy.where((lengths == best) & (best > 0), longestRouteBonus, 0).astype(numpy.int32)
+
+    def longestRoutes(self, labels: numpy.ndarray) -> numpy.ndarray:
+        """
+        (games, players) longest continuous route per player, exact for every player who can tie for the longest in their game and never above the exact length for the others.
+
+        A component with at most 2 odd degree cities has a trail through all of its routes, so only the other components large enough to matter are searched with engine.scoring.longestTrail.
+        """
+        cities = len(self.mapData.cities)
+        games, routes = numpy.nonzero(self.routeOwner >= 0)
+        players = self.routeOwner[games, routes].astype(numpy.int64)
+        city1, city2 = self.mapData.routes[routes, 0], self.mapData.routes[routes, 1]
+        components = labels[games, players, city1].astype(numpy.int64)
+        sizes = numpy.zeros((self.games, self.numPlayers, cities), dtype=numpy.int32)
+        numpy.add.at(sizes, (games, players, components), self.weight[routes])
+        degrees = numpy.zeros((self.games, self.numPlayers, cities), dtype=numpy.int16)
+        numpy.add.at(degrees, (games, players, city1), 1)
+        numpy.add.at(degrees, (games, players, city2), 1)
+        odd = numpy.zeros((self.games, self.numPlayers, cities), dtype=numpy.int16)
+        every = numpy.indices(labels.shape)
+        numpy.add.at(odd, (every[0], every[1], labels), degrees % 2)
+
+        trail = odd <= 2
+        lengths = numpy.where(trail, sizes, 0).max(axis=2)
+        search = ~trail & (sizes > lengths[:, :, None]) & (sizes >= lengths.max(axis=1)[:, None, None])
+        # Routes grouped by (game, player, component) to slice out each searched component
+        keys = (games * self.numPlayers + players) * cities + components
+        order = numpy.argsort(keys, kind='stable')
+        keys, routes = keys[order], routes[order]
+        for game, player, component in zip(*numpy.nonzero(search)):
+            key = (game * self.numPlayers + player) * cities + component
+            found = routes[numpy.searchsorted(keys, key):numpy.searchsorted(keys, key, side='right')]
+            lengths[game, player] = max(lengths[game, player], longestTrail(self.mapData, found.tolist()))
+        return lengths
+
+    def agentPoints(self) -> numpy.ndarray:
+        """
+        (games, players) final points by agent instead of by seat
+        """
+        points = numpy.zeros_like(self.points)
+        numpy.put_along_axis(points, self.seats, self.points, axis=1)
+        return points
+
+def simulateLockstep(map: str, numPlayers: int, runs: int, batch: int = 4096, seed: int = None, stopChance: float = 1/26) -> numpy.ndarray:
+    """
+    Plays runs games between numPlayers Random agents in lockstep batches of up to batch games, returns the (runs, players) final points of each agent
+    """
+    mapData = getMap(map)
+    rng = numpy.random.default_rng(seed)
+    points = []
+    while runs > 0:
+        games = LockstepGames(mapData, numPlayers, min(batch, runs), rng, stopChance)
+        games.play()
+        games.endGame()
+        points.append(games.agentPoints())
+        runs -= games.games
+    return numpy.concatenate(points)
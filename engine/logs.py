@@ -0,0 +1,54 @@
+import json
+
+OFF, INFO, DEBUG = 0, 1, 2
+"""Log levels: INFO is the basic game log, DEBUG adds the decks and the moves agents wanted but could not make"""
+levelNames = {INFO: 'INFO', DEBUG: 'DEBUG'}
+
+class TextSink:
+    """
+    Writes events as the lines of log.txt to a buffered file
+    """
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "w", buffering=1 << 16)
+
+    def write(self, game: int, level: int, event: str, message: str, fields: dict) -> None:
+        self.file.write(message.format(**fields))
+
+    def close(self) -> None:
+        self.file.close()
+
+class JsonLinesSink:
+    """
+    Writes events as JSON lines ({"game", "level", "event", fields...}) to a buffered file, without formatting their messages
+    """
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "w", buffering=1 << 16)
+
+    def write(self, game: int, level: int, event: str, message: str, fields: dict) -> None:
+        self.file.write(json.dumps({'game': game, 'level': levelNames[level], 'event': event, **fields}, default=str) + "\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+def openSink(path: str) -> TextSink | JsonLinesSink:
+    """
+    A JsonLinesSink for .jsonl paths, a TextSink otherwise
+    """
+    return JsonLinesSink(path) if path.endswith(".jsonl") else TextSink(path)
+
+class GameLog:
+    """
+    The event log of one game, streamed to a sink as the game runs. Several games (for example a batch simulation) can share one sink, each with its own game number.
+
+    Callers check info/debug before building an event so that a disabled log costs one attribute lookup. The message is a str.format template of the fields, it is only formatted by sinks writing text.
+    """
+    def __init__(self, sink: TextSink | JsonLinesSink = None, level: int = INFO, game: int = 0) -> None:
+        self.sink = sink
+        self.level = level if sink != None else OFF
+        self.game = game
+        self.info = self.level >= INFO
+        self.debug = self.level >= DEBUG
+
+    def write(self, level: int, event: str, message: str, **fields) -> None:
+        if level <= self.level:
+            self.sink.write(self.game, level, event, message, fields)
@@ -0,0 +1,136 @@
+import numpy
+from engine.build import Action
+from engine.compact import CompactState, UNCLAIMED, WILD, PAYMENTS
+from engine.data import MapData, getMap, listColors, listDestTakes, GRAY
+
+class ActionSpace:
+    """
+    A fixed numbering of every action of a map, so that the legal actions of a state can be computed as one boolean mask.
+
+    Index layout:
+    route claims - route * PAYMENTS + payment, where payment is 3 * color + (0 [color], 1 [color, WILD], 2 [WILD, color]) or 3 * WILD for [WILD]
+    faceUp + color - drawing a face up card of that color
+    faceDown - drawing from the deck
+    destinationDraw - drawing destination cards (revealing the deal)
+    destinationTake + i - keeping listDestTakes()[i] of the deal
+    """
+    def __init__(self, mapData: MapData) -> None:
+        self.mapData = mapData
+        routes = len(mapData.weight)
+        self.faceUp = routes * PAYMENTS
+        self.faceDown = self.faceUp + 9
+        self.destinationDraw = self.faceDown + 1
+        self.destinationTake = self.destinationDraw + 1
+        self.size = self.destinationTake + len(listDestTakes())
+
+        # Per route tables for the vectorized pass
+        self.weight = numpy.array(mapData.weight, dtype=numpy.int16)[:, None]
+        self.gray = numpy.array(mapData.color) == GRAY
+        self.routeColors = numpy.zeros((routes, WILD), dtype=bool)
+        """Which non wild colors can pay for each route"""
+        self.routeColors[self.gray] = True
+        self.routeColors[numpy.flatnonzero(~self.gray), numpy.array(mapData.color)[~self.gray]] = True
+        self.sibling = numpy.array(mapData.sibling)
+        self.hasSibling = self.sibling >= 0
+        self.sibling[~self.hasSibling] = 0
+
+        # One shared Action per index
+        colorNames = listColors()
+        actions = []
+        for route in range(routes):
+            edge = mapData.edges[route]
+            for color in range(WILD):
+                actions.append(Action(0, edge, [colorNames[color]]))
+                actions.append(Action(0, edge, [colorNames[color], 'WILD']))
+                actions.append(Action(0, edge, ['WILD', colorNames[color]]))
+            actions.append(Action(0, edge, ['WILD']))
+        for color in colorNames:
+            actions.append(Action(1, colorPicked=[color]))
+        actions.append(Action(2))
+        actions.append(Action(3))
+        for take in listDestTakes():
+            actions.append(Action(3, destinationsPicked=take))
+        self.actions = tuple(actions)
+
+    def index(self, action: Action) -> int:
+        """
+        The index of an action in this space
+        """
+        if action.action == 0:
+            route = action.routeToPlace[2]['index'] * PAYMENTS
+            if action.colorsUsed == ['WILD']:
+                return route + 3*WILD
+            elif action.colorsUsed[0] == 'WILD':
+                return route + 3*listColors().index(action.colorsUsed[1]) + 2
+            elif len(action.colorsUsed) == 2:
+                return route + 3*listColors().index(action.colorsUsed[0]) + 1
+            return route + 3*listColors().index(action.colorsUsed[0])
+        elif action.action == 1:
+            return self.faceUp + listColors().index(action.colorPicked[0])
+        elif action.action == 2:
+            return self.faceDown
+        elif action.destinationsPicked == None:
+            return self.destinationDraw
+        return self.destinationTake + listDestTakes().index(list(action.destinationsPicked))
+
+    def legalMask(self, state: CompactState, previousAction: int = None) -> numpy.ndarray:
+        """
+        The boolean mask over this space of the actions the current player can take. previousAction is the move being followed up (state.followUpFromMove).
+
+        Route claims follow the "desire" architecture of the engine: all of one color is used before the other, so for example 4 blues and 2 wilds on a 3 blue route gives [BLUE] and [WILD, BLUE] but never 2 blues and 1 wild.
+        """
+        mask = numpy.zeros(self.size, dtype=bool)
+        if state.gameOver == True:
+            return mask
+        player = state.currentPlayer
+        hand = state.hands[player]
+
+        # 0 - Placing trains, routes x colors in one pass
+        if previousAction == None:
+            numWilds = int(hand[WILD])
+            numColors = hand[:WILD]
+            # Open: unclaimed, the player does not own the other track and has the trains
+            open = (state.routeOwner == UNCLAIMED) & (self.weight[:, 0] <= state.trainsLeft[player])
+            open &= ~(self.hasSibling & (state.routeOwner[self.sibling] == player))
+            payable = self.routeColors & open[:, None] & (numColors > 0)
+            withWilds = numColors + numWilds
+            claims = mask[:self.faceUp].reshape(-1, PAYMENTS)
+            claims[:, 0:3*WILD:3] = payable & (numColors >= self.weight)
+            if numWilds > 0:
+                claims[:, 1:3*WILD:3] = payable & (numColors < self.weight) & (withWilds >= self.weight)
+                claims[:, 2:3*WILD:3] = payable & (numWilds < self.weight) & (withWilds > self.weight)
+                claims[:, 3*WILD] = open & self.gray & (numWilds >= self.weight[:, 0])
+
+        # 1 & 2 - Draw Face Up or from Deck
+        if previousAction == 1 or previousAction == 2:
+            # If we are drawing the second card, a face up wild can not be picked
+            mask[self.faceUp:self.faceUp + WILD] = state.faceUpCards[:WILD] > 0
+            mask[self.faceDown] = state.trainCarCount >= 1
+        elif previousAction == None and state.faceUpCards.sum() + state.trainCarCount >= 2:
+            mask[self.faceUp:self.faceDown] = state.faceUpCards > 0
+            mask[self.faceDown] = state.trainCarCount >= 1
+
+        # 3 - Draw Destination Cards
+        if previousAction == 3:
+            mask[self.destinationTake:] = True
+        elif previousAction == None and state.destinationCount > 2:
+            mask[self.destinationDraw] = True
+
+        return mask
+
+    def legalActions(self, state: CompactState, previousAction: int = None) -> tuple[numpy.ndarray, list[Action]]:
+        """
+        The legal action mask and the list of the legal actions it marks
+        """
+        mask = self.legalMask(state, previousAction)
+        return mask, [self.actions[index] for index in numpy.flatnonzero(mask)]
+
+_actionSpaces: dict[str, ActionSpace] = {}
+
+def getActionSpace(map: str) -> ActionSpace:
+    """
+    Returns the ActionSpace of a map, building it on first use
+    """
+    if map not in _actionSpaces:
+        _actionSpaces[map] = ActionSpace(getMap(map))
+    return _actionSpaces[map]
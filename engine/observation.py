@@ -0,0 +1,86 @@
+import numpy
+import networkx as nx
+from types import MappingProxyType
+
+def cached(method):
+    """
+    A read-only Observation property computed on first read and kept until Observation.invalidate
+    """
+    name = method.__name__
+    def get(self):
+        if name not in self.cache:
+            self.cache[name] = method(self)
+        return self.cache[name]
+    return property(get, doc=method.__doc__)
+
+class Observation:
+    """
+    What an agent sees of a Game when asked for a turn (see Agent.turn). It is a read-only view: every quantity is computed from the game when first read and cached until the game state changes (Game.step invalidates it before every move), so an agent pays only for what it reads and asking it again after a rejected choice costs nothing.
+
+    player, requested and destinationDeal describe the request: the turn order of the agent asked, the turn actions it was asked to choose from (None for any valid one) and the destination cards dealt to choose from.
+    """
+    def __init__(self, game) -> None:
+        self.game = game
+        self.cache = {}
+        self.player: int = None
+        self.requested: list[int] = None
+        self.destinationDeal: list[list[str]] = None
+
+    def invalidate(self) -> None:
+        self.cache.clear()
+
+    @cached
+    def board(self) -> nx.MultiGraph:
+        """The board as a read-only view of the game's"""
+        return self.game.board.copy(as_view=True)
+
+    @cached
+    def faceUpCards(self) -> tuple[str]:
+        return tuple(self.game.faceUpCards)
+
+    @cached
+    def playerPoints(self) -> tuple[int]:
+        """Points of each player (by turn order)"""
+        return tuple(agent.points for agent in self.game.players)
+
+    @cached
+    def playerHandSizes(self) -> tuple[int]:
+        """Train cards held by each player (by turn order)"""
+        return tuple(sum(agent.hand_trainCards) for agent in self.game.players)
+
+    @cached
+    def playerDestSizes(self) -> tuple[int]:
+        """Destination cards held by each player (by turn order)"""
+        return tuple(len(agent.hand_destinationCards) for agent in self.game.players)
+
+    @cached
+    def trainsLeft(self) -> tuple[int]:
+        """Trains left to each player (by turn order)"""
+        return tuple(agent.trainsLeft for agent in self.game.players)
+
+    @cached
+    def actionMap(self) -> MappingProxyType:
+        """The game's action map (see Game.getActionMap)"""
+        return MappingProxyType(self.game.actionMap)
+
+    @cached
+    def validMoves(self) -> tuple[int]:
+        """The turn action indexes the agent can choose from"""
+        return tuple(self.game.validGameMoves if self.requested == None else self.requested)
+
+    @cached
+    def state(self):
+        """The game state as an engine.compact.CompactState with the agent asked as its current player (in the last round the engine's turn counter does not follow the turn order)"""
+        from engine.compact import CompactState
+        state = CompactState.fromGame(self.game)
+        if self.player != None:
+            state.turn += (self.player - state.currentPlayer) % len(self.game.players)
+        return state
+
+    @cached
+    def legalMask(self) -> numpy.ndarray:
+        """The legal actions of the player over engine.moves.ActionSpace, a boolean mask"""
+        from engine.moves import getActionSpace
+        mask = getActionSpace(self.game.mapName).legalMask(self.state, self.game.movePerforming)
+        mask.flags.writeable = False
+        return mask
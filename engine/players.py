@@ -1,13 +1,12 @@
 from random import sample, randint, shuffle
-import engine
-import networkx as nx
-from networkx import MultiGraph
 from engine.data import listColors
+from engine.observation import Observation
 
 class Agent:
     def __init__(self, name: str) -> None:
         self.name = name
-        self.hand_trainCards = []
+        self.hand_trainCards = [0]*9
+        """Train card counts indexed by engine.data.indexByColor"""
         self.hand_destinationCards = []
         self.trainsLeft = 45
         self.points = 0
@@ -21,9 +20,9 @@ class Agent:
         """
         pass
 
-    def turn(self, board: nx.MultiGraph, faceUpCards: list[str], playerPoints: list[int], playerHandSizes: list[int], playerDestSizes: list[int], actionMap: dict[int, list], i = None, destCardDeal = None) -> tuple[int, list[int], list[str]]:
+    def turn(self, observation: Observation, i = None, destCardDeal = None) -> tuple[int, list[int], list[str]]:
         """
-        Returns a number corresponding to the desired turn action to make given the template board, the current board, the face up cards, the points of each player, the size of each players hand, how many destination cards the other players have, and the action map. Optionally, use i to request a action desire (ex. for a card draw you must draw 2 cards, this would be done by requesting the next card draw to fulfill the second draw requirement)
+        Returns a number corresponding to the desired turn action to make given the observation of the game (engine.observation.Observation: the board, the face up cards, the points of each player, the size of each players hand, how many destination cards the other players have, the action map and the legal action mask, each computed only when read). Optionally, use i to request a action desire (ex. for a card draw you must draw 2 cards, this would be done by requesting the next card draw to fulfill the second draw requirement)
         
         Returns a tuple of (turn action, action desire, card desire), where action desire is an iterable sequence of indexes corresponding to the actionMap that will be checked left to right for valid moves. NOTE: the action distribution is only relevant for drawing destination cards and placing trains.
         
@@ -59,13 +58,13 @@ class Random(Agent):
             self.hand_destinationCards.append(deal[cardNum])
         return selections
     
-    def turn(self, board: MultiGraph, faceUpCards: list[str], playerPoints: list[int], playerHandSizes: list[int], playerDestSizes: list[int], actionMap: dict[int, list], i = None, destCardDeal = None) -> tuple[int, list[int], list[str]]:
+    def turn(self, observation: Observation, i = None, destCardDeal = None) -> tuple[int, list[int], list[str]]:
         if i == None:
             i = randint(0, 3)
         else:
             shuffle(i)
             i = i[0]
-        actionDistribution = [x for x in range(0, len(actionMap[i]), 1)]
+        actionDistribution = [x for x in range(0, len(observation.actionMap[i]), 1)]
         shuffle(actionDistribution)
         cardsDistribution = listColors()
         shuffle(cardsDistribution)
@@ -0,0 +1,208 @@
+import mmap
+import numpy
+import random
+import struct
+from engine.compact import CompactState, BLOCKED, WILD, PAYMENTS
+from engine.data import MapData, getMap, listColors, listDestTakes
+
+MAGIC = b"TTRR"
+VERSION = 1
+
+class TraceCodes:
+    """
+    The integer codes of a game trace on one map. Moves use the numbering of engine.moves.ActionSpace, then come a mark per player starting a turn and the debug stop.
+
+    route claims - route * PAYMENTS + payment
+
+    faceUp + color, faceDown - train card draws
+
+    destinationDraw, destinationTake + i - a destination deal and keeping listDestTakes()[i] of it (the deal of the first turn included)
+
+    turn + player - the player (by turn order) starts a turn
+
+    stop - the debug stop of Game.performAction ended the turn
+    """
+    def __init__(self, mapData: MapData) -> None:
+        self.faceUp = len(mapData.weight) * PAYMENTS
+        self.faceDown = self.faceUp + 9
+        self.destinationDraw = self.faceDown + 1
+        self.destinationTake = self.destinationDraw + 1
+        self.turn = self.destinationTake + len(listDestTakes())
+        self.stop = self.turn + 4
+
+    def claim(self, route: int, cards: list[int]) -> int:
+        """
+        The code of claiming a route (by index) with the given card counts, which are whole cards of one color and/or wilds
+        """
+        colors = [color for color in range(WILD) if cards[color] > 0]
+        if len(colors) == 0:
+            return route * PAYMENTS + 3*WILD
+        # Wilds are spent before the color when both are used
+        return route * PAYMENTS + 3*colors[0] + (2 if cards[WILD] > 0 else 0)
+
+    def take(self, taken: list[int]) -> int:
+        """
+        The code of keeping the given positions of a destination deal
+        """
+        return self.destinationTake + listDestTakes().index(sorted(taken))
+
+_traceCodes: dict[str, TraceCodes] = {}
+
+def getTraceCodes(map: str) -> TraceCodes:
+    """
+    Returns the TraceCodes of a map, building them on first use
+    """
+    if map not in _traceCodes:
+        _traceCodes[map] = TraceCodes(getMap(map))
+    return _traceCodes[map]
+
+class GameRecord:
+    """
+    Everything needed to replay a game: the map, the player names in the order given to Game (before it shuffles them), the seed of the deck shuffles and the trace of codes (see TraceCodes)
+    """
+    def __init__(self, map: str, names: list[str], seed: int, trace: numpy.ndarray) -> None:
+        self.map = map
+        self.names = names
+        self.seed = seed
+        self.trace = trace
+
+class RecordWriter:
+    """
+    Streams GameRecords of one map into a binary file.
+
+    Layout (little endian): MAGIC, version (u8), map name (u8 length + utf-8), then per game seed (u64), player count (u8), names (u8 length + utf-8 each), trace length (u32) and the trace (u16 each), then the index of game offsets (u64 each) and a footer of the index offset (u64), game count (u32) and MAGIC.
+    """
+    def __init__(self, path: str, map: str) -> None:
+        self.map = map
+        self.file = open(path, "wb")
+        self.offsets: list[int] = []
+        name = map.encode()
+        self.file.write(MAGIC + struct.pack("<BB", VERSION, len(name)) + name)
+
+    def write(self, record: GameRecord) -> None:
+        if record.map != self.map:
+            raise ValueError(f"Record of map {record.map} written to a {self.map} record file.")
+        self.offsets.append(self.file.tell())
+        block = [struct.pack("<QB", record.seed, len(record.names))]
+        for name in record.names:
+            name = name.encode()
+            block.append(struct.pack("<B", len(name)) + name)
+        block.append(struct.pack("<I", len(record.trace)))
+        block.append(numpy.asarray(record.trace, dtype="<u2").tobytes())
+        self.file.write(b"".join(block))
+
+    def close(self) -> None:
+        index = self.file.tell()
+        self.file.write(numpy.array(self.offsets, dtype="<u8").tobytes())
+        self.file.write(struct.pack("<QI", index, len(self.offsets)) + MAGIC)
+        self.file.close()
+
+class GameRecords:
+    """
+    Random access to the games of a file written by RecordWriter. The file is memory-mapped, so reading a game only touches its block and its trace is a view of the file.
+    """
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:4] != MAGIC or self.data[-4:] != MAGIC:
+            raise ValueError(f"{path} is not a game record file.")
+        version, length = struct.unpack_from("<BB", self.data, 4)
+        if version != VERSION:
+            raise ValueError(f"{path} has record version {version}, expected {VERSION}.")
+        self.map = self.data[6:6 + length].decode()
+        index, count = struct.unpack_from("<QI", self.data, len(self.data) - 16)
+        self.offsets = numpy.frombuffer(self.data, dtype="<u8", count=count, offset=index)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, game: int) -> GameRecord:
+        offset = int(self.offsets[game])
+        seed, players = struct.unpack_from("<QB", self.data, offset)
+        offset += 9
+        names = []
+        for _ in range(players):
+            length = self.data[offset]
+            names.append(self.data[offset + 1:offset + 1 + length].decode())
+            offset += 1 + length
+        length, = struct.unpack_from("<I", self.data, offset)
+        trace = numpy.frombuffer(self.data, dtype="<u2", count=length, offset=offset + 4)
+        return GameRecord(self.map, names, seed, trace)
+
+def initialState(record: GameRecord) -> CompactState:
+    """
+    The state of a recorded game before its first turn, dealt like Game.__init__ does from the record's seed
+    """
+    setup = random.Random(record.seed)
+    names = list(record.names)
+    setup.shuffle(names)
+    state = CompactState(record.map, names)
+    mapData = state.mapData
+
+    if len(names) < 4:
+        # Only the first track of double routes is on the board
+        for route, sibling in enumerate(mapData.sibling):
+            if 0 <= sibling < route:
+                state.routeOwner[route] = BLOCKED
+                state.unclaimedRoutes &= ~mapData.routeBit[route]
+
+    trainCarDeck = ['PINK']*12+['WHITE']*12+['BLUE']*12+['YELLOW']*12+['ORANGE']*12+['BLACK']*12+['RED']*12+['GREEN']*12+['WILD']*14
+    setup.shuffle(trainCarDeck)
+    colors = listColors()
+    state.trainCarCount = len(trainCarDeck)
+    state.trainCarDeck[:] = [colors.index(color) for color in trainCarDeck]
+    destinationDeck = list(range(len(mapData.destinationCards)))
+    setup.shuffle(destinationDeck)
+    state.destinationCount = len(destinationDeck)
+    state.destinationDeck[:] = destinationDeck
+
+    for _ in range(5):
+        state.faceUpCards[state.popTrainCar()] += 1
+    for player in range(len(names)):
+        for _ in range(4):
+            state.hands[player, state.popTrainCar()] += 1
+    state.colorCounting[:, :, 9] = 4
+    state.turn = 1 - len(names)
+    return state
+
+def replayCompact(record: GameRecord, position: int = None) -> CompactState:
+    """
+    Rebuilds the state of a recorded game after the first position codes of its trace (the whole trace by default) without the agents.
+
+    The turn is the engine's turn counter of the turn in progress, and the player to move is the one whose turn mark came last (in the last round the engine does not follow the turn order).
+    """
+    from engine.moves import getActionSpace
+
+    state = initialState(record)
+    codes = getTraceCodes(record.map)
+    actions = getActionSpace(record.map).actions
+    trace = record.trace if position == None else record.trace[:position]
+    turn = state.turn - 1
+    player = None
+    lastRound = False
+
+    for code in trace.tolist():
+        if code >= codes.stop:
+            # The debug stop takes back the turn but play() counts it again, the turn counter is unchanged
+            continue
+        elif code >= codes.turn:
+            player = code - codes.turn
+            # The engine's turn counter skips its increment going into the last round
+            if not (state.lastTurn and not lastRound):
+                turn += 1
+            lastRound = state.lastTurn
+            state.followUpFromMove = None
+            state.destinationDeal = None
+        else:
+            state.apply(actions[code], player)
+        state.turn = turn
+        state.gameOver = False
+
+    state.gameOver = position == None or position >= len(record.trace)
+    return state
+
+def replay(record: GameRecord, position: int = None):
+    """
+    The State of a recorded game after the first position codes of its trace (see replayCompact)
+    """
+    return replayCompact(record, position).toState()
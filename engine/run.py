@@ -1,10 +1,105 @@
 import time
-from engine.build import Action, Game, State
-from engine.players import Agent
+import random
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+from engine.build import Game
+from engine.logs import GameLog, INFO, DEBUG, openSink
+from engine.records import RecordWriter
+from engine.compact import CompactState
+from engine.players import Agent, Random
+from engine.lockstep import simulateLockstep
 from models.mcts import MonteCarloSearch, Node
+from models.network import Network
 
 
-def play(map: str, players: list[Agent], logs: bool, debug: bool, runs: int, drawGame: bool) -> Game:
+def simulateGames(map: str, agents: list[tuple[type, str]], debug: bool, runs: int, seed: int) -> dict[str, int]:
+    """
+    Worker for parallel batches: plays runs games with its own agent instances (built from (agent class, name) pairs) and its own RNG stream, returns the total points per agent name
+    """
+    random.seed(seed)
+    numpy.random.seed(seed % 2**32)
+    players = [agent(name) for agent, name in agents]
+    playerInfo = { player.name: 0 for player in players }
+
+    for _ in range(runs):
+        for player in players:
+            player.__init__(player.name)
+        Game(map, players, False, debug, False)
+        for player in players:
+            playerInfo[player.name] += player.points
+
+    return playerInfo
+
+def playLockstep(map: str, players: list[Agent], runs: int, batch: int = 4096, seed: int = None, stopChance: float = 1/26) -> None:
+    """
+    Play a batch of Ticket to Ride games between Random agents with engine.lockstep, printing the same averages as play
+
+    batch - games advanced together in lockstep (memory grows with it)
+
+    seed - seeds the simulation, None for a random seed
+
+    stopChance - chance of the engine's debug stop per action (see LockstepGames), 0 plays every game to its end
+    """
+    if not all(type(player) == Random for player in players):
+        raise ValueError("The lockstep simulator only plays Random agents.")
+
+    start = time.time()
+    print(f"Simulating {runs} games in lockstep...")
+
+    points = simulateLockstep(map, len(players), runs, batch, seed, stopChance)
+    for player, total in zip(players, points.sum(axis=0)):
+        print(f"{player.name} {total/runs} avg points")
+
+    end = time.time()
+    print(f"Completed in {round(end-start, 2)} seconds")
+
+class LatencyNetwork(Network):
+    """
+    The placeholder network with a fixed wait per forward pass that releases the GIL, standing in for a model evaluated outside Python (on a GPU or in a native library) when timing search. It keeps no evaluation cache, every leaf pays the wait.
+    """
+    concurrent = True
+
+    def __init__(self, map: str, latency: float) -> None:
+        super().__init__(map, cacheSize=0)
+        self.latency = latency
+
+    def forward(self, states: list[CompactState]) -> list[tuple]:
+        time.sleep(self.latency)
+        return super().forward(states)
+
+def benchmarkSearch(map: str, players: list[Agent], simulations: int = 800, workers: tuple[int] = (1, 2, 4), batchSize: int = 1, latency: float = 0.002, seed: int = None) -> dict[int, float]:
+    """
+    Times MonteCarloSearch on one mid game state for each worker count (1 is the single-threaded search), printing and returning the simulations per second of each
+
+    simulations - simulations per search
+
+    batchSize - leaves each worker evaluates per network pass
+
+    latency - seconds each network pass waits (see LatencyNetwork), 0 times the placeholder network alone, which tree-parallel search cannot speed up
+
+    seed - seeds the game the state comes from, None for a random seed
+    """
+    random.seed(seed)
+    numpy.random.seed(None if seed == None else seed % 2**32)
+    # The debug stop ends the game at a random point, the search starts from there
+    state = None
+    while state == None or state.gameOver:
+        for player in players:
+            player.__init__(player.name)
+        game = Game(map, players, False)
+        state = CompactState.fromGame(game)
+
+    rates = {}
+    print(f"Searching {simulations} simulations from turn {state.turn}...")
+    for count in workers:
+        start = time.perf_counter()
+        network = LatencyNetwork(map, latency) if latency > 0 else None
+        MonteCarloSearch(Node(state.copy()), simulations, batchSize=batchSize, workers=count, network=network)
+        rates[count] = simulations / (time.perf_counter() - start)
+        print(f"{count} workers {round(rates[count])} simulations/second")
+    return rates
+
+def play(map: str, players: list[Agent], logs: bool, debug: bool, runs: int, drawGame: bool, workers: int = 1, seed: int = None, logFile: str = "log.txt", recordFile: str = None) -> Game:
     """
     Play a single or batch of Ticket to Ride games using the engine
     
@@ -14,18 +109,57 @@ def play(map: str, players: list[Agent], logs: bool, debug: bool, runs: int, dra
 
     agents - a list of 2-4 agents available: "Random"
 
-    logs - print the logs to log.txt (if multiple games simulated, will only print last one)
+    logs - stream the logs of every game to logFile as they are played
 
     debug - add more descriptive statements to the logs
 
     drawGame - only for single-game simulations, will draw the final game map using matplotlib
+
+    workers - processes to shard a batch of games across (1 plays them in this process). Each worker gets its own agent instances and RNG stream, so agents must be constructible from their name alone, and no logs are written
+
+    seed - seeds the RNG streams of the workers, None for a random seed
+
+    logFile - the file logs go to, as the text of log.txt or as JSON lines if it ends in .jsonl
+
+    recordFile - if given, the record of every game (see engine.records) is written to this file, from which any state of the games can be replayed. Not available with workers
     """
 
     game = None 
     iterations = runs
 
+    sink = openSink(logFile) if logs and workers == 1 else None
+    level = DEBUG if debug else INFO
+    records = RecordWriter(recordFile, map) if recordFile != None and workers == 1 else None
+
     if runs == 1:
-        game = Game(map, players, logs, debug, drawGame)
+        game = Game(map, players, logs, debug, drawGame, gameLog=GameLog(sink, level))
+        if records != None:
+            records.write(game.record())
+
+    elif workers > 1:
+
+        start = time.time()
+
+        playerInfo = { player.name: 0 for player in players }
+        print(f"Simulating {runs} games on {workers} processes...")
+
+        agents = [(type(player), player.name) for player in players]
+        seeds = [int(s.generate_state(1, numpy.uint64)[0]) for s in numpy.random.SeedSequence(seed).spawn(workers)]
+        shards = [runs // workers + (1 if i < runs % workers else 0) for i in range(workers)]
+        with ProcessPoolExecutor(workers) as pool:
+            results = pool.map(simulateGames, [map]*workers, [agents]*workers, [debug]*workers, shards, seeds)
+            for result in results:
+                for name, points in result.items():
+                    playerInfo[name] += points
+
+        for name, points in playerInfo.items():
+            print(f"{name} {points/iterations} avg points")
+
+        end = time.time()
+        print(f"Completed in {round(end-start, 2)} seconds")
+
+        # Games were played in the workers, there is no game object to return
+        return None
 
     else:
         
@@ -39,7 +173,9 @@ def play(map: str, players: list[Agent], logs: bool, debug: bool, runs: int, dra
             for player in players:
                 player = player.__init__(player.name)
 
-            game = Game(map, players, logs, debug, False)
+            game = Game(map, players, logs, debug, False, gameLog=GameLog(sink, level, iterations - runs))
+            if records != None:
+                records.write(game.record())
 
             for player in players:
                 playerInfo[player.name] += player.points
@@ -51,9 +187,14 @@ def play(map: str, players: list[Agent], logs: bool, debug: bool, runs: int, dra
         
         end = time.time()
         print(f"Completed in {round(end-start, 2)} seconds")
+
+    if sink != None:
+        sink.close()
+    if records != None:
+        records.close()
     
     # Testing MCTS
-    state = State(game.board, game.faceUpCards, game.trainCarDeck, game.destinationsDeck, game.players, game.turn, game.mapName, game.movePerforming, game.wildFromFaceUp, game.destinationDeal, game.validGameMoves, game.actionMap, game.lastTurn, game.endedGame, game.gameOver)
+    state = CompactState.fromGame(game)
     if state.followUpFromMove == 1 or state.followUpFromMove == 2:
         color = game.colorPicked
         node = Node(state, fromAction=state.followUpFromMove, color=[color])
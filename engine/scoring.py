@@ -0,0 +1,139 @@
+from engine.data import MapData, bitIndexes
+
+class CityConnectivity:
+    """
+    Incremental connectivity (union-find over city ids) of the routes claimed by one player. Two cities are connected when the player can travel between them on their own routes, which is what completing a destination ticket means.
+    """
+    __slots__ = ('parent', 'size')
+
+    def __init__(self, cities: int) -> None:
+        self.parent = list(range(cities))
+        self.size = [1]*cities
+
+    def find(self, city: int) -> int:
+        root = city
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Path compression
+        while self.parent[city] != root:
+            self.parent[city], city = root, self.parent[city]
+        return root
+
+    def union(self, city1: int, city2: int) -> None:
+        root1 = self.find(city1)
+        root2 = self.find(city2)
+        if root1 == root2:
+            return
+        if self.size[root1] < self.size[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] += self.size[root2]
+
+    def connected(self, city1: int, city2: int) -> bool:
+        return self.find(city1) == self.find(city2)
+
+    def addRoute(self, mapData: MapData, route: int) -> None:
+        """
+        Joins the two cities of a route (by index)
+        """
+        self.union(mapData.routeCity1[route], mapData.routeCity2[route])
+
+    def isTicketComplete(self, mapData: MapData, destination: int) -> bool:
+        """
+        Whether the destination ticket (by index) is complete
+        """
+        return self.connected(mapData.destinationCity1[destination], mapData.destinationCity2[destination])
+
+    def copy(self) -> 'CityConnectivity':
+        new = CityConnectivity.__new__(CityConnectivity)
+        new.parent = self.parent.copy()
+        new.size = self.size.copy()
+        return new
+
+def buildConnectivity(mapData: MapData, routes: list[int]) -> CityConnectivity:
+    """
+    The connectivity of a set of claimed routes (by index)
+    """
+    connectivity = CityConnectivity(len(mapData.cities))
+    for route in routes:
+        connectivity.addRoute(mapData, route)
+    return connectivity
+
+def longestTrail(mapData: MapData, routes: list[int]) -> int:
+    """
+    The length (in trains) of the longest continuous path through the given routes (by index, forming one connected component) where no route is used twice, as scored by the longest route bonus. This is a depth first search over every trail, which is exponential in general but cheap on the route sets of one player's connected component.
+    """
+    adjacency: dict[int, list[tuple[int, int, int]]] = {}
+    for route in routes:
+        city1, city2 = mapData.routeCity1[route], mapData.routeCity2[route]
+        adjacency.setdefault(city1, []).append((mapData.routeBit[route], city2, mapData.weight[route]))
+        adjacency.setdefault(city2, []).append((mapData.routeBit[route], city1, mapData.weight[route]))
+
+    best = 0
+    def walk(city: int, used: int, length: int) -> None:
+        nonlocal best
+        if length > best:
+            best = length
+        for bit, nextCity, weight in adjacency[city]:
+            if used & bit == 0:
+                walk(nextCity, used | bit, length + weight)
+
+    # In a connected component with odd degree cities, some longest trail starts at one of them (otherwise it could be extended)
+    oddCities = [city for city, paths in adjacency.items() if len(paths) % 2 == 1]
+    for city in (oddCities if len(oddCities) > 0 else adjacency):
+        walk(city, 0, 0)
+    return best
+
+class LongestRoute:
+    """
+    The longest continuous route of one player, cached per connected component (by the CityConnectivity root city). A claim only marks the component it touches as stale (None), which is recomputed when the longest route is next asked for, so claims made while searching cost nothing until scoring.
+    """
+    __slots__ = ('lengths',)
+
+    def __init__(self) -> None:
+        self.lengths: dict[int, int] = {}
+
+    def addRoute(self, mapData: MapData, connectivity: CityConnectivity, route: int) -> None:
+        """
+        Updates the cache after a route (by index) was claimed. connectivity must already include the route.
+        """
+        root = connectivity.find(mapData.routeCity1[route])
+        # Components merged by the claim are no longer roots
+        for stale in [component for component in self.lengths if connectivity.find(component) != component]:
+            del self.lengths[stale]
+        self.lengths[root] = None
+
+    def longest(self, mapData: MapData, connectivity: CityConnectivity, owned: int) -> int:
+        """
+        The longest route, recomputing the stale components first. connectivity and owned (the route ownership bitmask) must be those of the routes claimed so far.
+        """
+        for root in [root for root, length in self.lengths.items() if length == None]:
+            component = [route for route in bitIndexes(owned) if connectivity.find(mapData.routeCity1[route]) == root]
+            self.lengths[root] = longestTrail(mapData, component)
+        return max(self.lengths.values(), default=0)
+
+    def copy(self) -> 'LongestRoute':
+        new = LongestRoute.__new__(LongestRoute)
+        new.lengths = self.lengths.copy()
+        return new
+
+def buildLongestRoute(mapData: MapData, connectivity: CityConnectivity, owned: int) -> LongestRoute:
+    """
+    The LongestRoute of a route ownership bitmask, where connectivity is the CityConnectivity of the same routes
+    """
+    longestRoute = LongestRoute()
+    components: dict[int, list[int]] = {}
+    for route in bitIndexes(owned):
+        components.setdefault(connectivity.find(mapData.routeCity1[route]), []).append(route)
+    for root, routes in components.items():
+        longestRoute.lengths[root] = longestTrail(mapData, routes)
+    return longestRoute
+
+def longestRouteWinners(lengths: list[int]) -> list[int]:
+    """
+    The players (by turn order) awarded the longest route bonus given each player's longest route, every tied player gets it
+    """
+    best = max(lengths)
+    if best == 0:
+        return []
+    return [player for player, length in enumerate(lengths) if length == best]
@@ -0,0 +1,86 @@
+import numpy
+from engine.data import MapData, getMap
+
+MAX_PLAYERS = 4
+MAX_CARDS = 110
+"""Train cards in the game, the most any count of them can reach"""
+
+class ZobristKeys:
+    """
+    The random 64-bit keys of Zobrist hashing on one map. The hash of a CompactState is the XOR of the keys of:
+
+    route - [route][owner] per claimed route
+
+    hand - [player][color][count] per hand count (zero counts add nothing)
+
+    faceUp - [color][count] per face up count
+
+    trainCars, destinationStart, destinationCount - the deck positions, which with the fixed order of a game's decks and the cards held stand for the decks' contents
+
+    destination - [player][destination] per destination card held
+
+    player, followUp, lastTurn, endedGame, gameOver - the turn phase: the player to move, the move being followed up (index 0 for None), whether it is the last round, who ended the game and whether it is over
+
+    Points, trains left and card counting follow from these and are left out. Keys are drawn from a fixed seed, so hashes agree between processes and runs.
+    """
+    def __init__(self, mapData: MapData, seed: int = 0x7A0B) -> None:
+        rng = numpy.random.default_rng(seed)
+        def draw(*shape: int) -> list:
+            return rng.integers(1, 2**64, size=shape, dtype=numpy.uint64, endpoint=False).tolist()
+        routes = len(mapData.weight)
+        destinations = len(mapData.destinationCards)
+        self.route = draw(routes, MAX_PLAYERS)
+        self.hand = draw(MAX_PLAYERS, 9, MAX_CARDS + 1)
+        self.faceUp = draw(9, 6)
+        for counts in [counts for player in self.hand for counts in player] + self.faceUp:
+            counts[0] = 0
+        self.trainCars = draw(MAX_CARDS + 1)
+        self.destinationStart = draw(destinations)
+        self.destinationCount = draw(destinations + 1)
+        self.destination = draw(MAX_PLAYERS, destinations)
+        self.player = draw(MAX_PLAYERS)
+        self.followUp = draw(4)
+        self.lastTurn = draw(1)[0]
+        self.endedGame = draw(MAX_PLAYERS)
+        self.gameOver = draw(1)[0]
+
+    def phase(self, state) -> int:
+        """
+        The keys of the turn phase and deck positions of a state
+        """
+        key = self.player[state.currentPlayer] ^ self.followUp[state.followUpFromMove or 0]
+        key ^= self.trainCars[state.trainCarCount] ^ self.destinationStart[state.destinationStart] ^ self.destinationCount[state.destinationCount]
+        if state.lastTurn:
+            key ^= self.lastTurn
+        if state.endedGame != None and state.endedGame is not False:
+            key ^= self.endedGame[state.endedGame]
+        if state.gameOver:
+            key ^= self.gameOver
+        return key
+
+    def hashState(self, state) -> int:
+        """
+        The full hash of a CompactState, computed from scratch
+        """
+        key = self.phase(state)
+        for route, owner in enumerate(state.routeOwner.tolist()):
+            if owner >= 0:
+                key ^= self.route[route][owner]
+        for player in range(state.numPlayers):
+            for color, count in enumerate(state.hands[player].tolist()):
+                key ^= self.hand[player][color][count]
+            for destination in numpy.flatnonzero(state.destinations[player]).tolist():
+                key ^= self.destination[player][destination]
+        for color, count in enumerate(state.faceUpCards.tolist()):
+            key ^= self.faceUp[color][count]
+        return key
+
+_zobristKeys: dict[str, ZobristKeys] = {}
+
+def getZobristKeys(map: str) -> ZobristKeys:
+    """
+    Returns the ZobristKeys of a map, building them on first use
+    """
+    if map not in _zobristKeys:
+        _zobristKeys[map] = ZobristKeys(getMap(map))
+    return _zobristKeys[map]
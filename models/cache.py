@@ -0,0 +1,38 @@
+import threading
+from collections import OrderedDict
+
+class EvaluationCache:
+    """
+    Network outputs (a, Dc, Dd, Dr, W) by state fingerprint (see FeatureEncoder.fingerprint), holding at most maxEntries of them and evicting the least recently used. One entry of the list outputs of Network.play takes about 5KB.
+
+    It is safe to share between the threads of a tree-parallel search.
+    """
+    def __init__(self, maxEntries: int) -> None:
+        self.maxEntries = maxEntries
+        self.entries: OrderedDict[tuple, tuple] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: tuple) -> tuple:
+        """
+        The outputs cached for the fingerprint (now the most recently used), None if there are none
+        """
+        with self.lock:
+            output = self.entries.get(key)
+            if output == None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return output
+
+    def put(self, key: tuple, output: tuple) -> None:
+        with self.lock:
+            self.entries[key] = output
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
@@ -0,0 +1,106 @@
+import numpy
+from engine.compact import CompactState
+from engine.data import MapData, getMap
+
+MAX_PLAYERS = 4
+
+class FeatureEncoder:
+    """
+    Encodes batches of CompactStates into the network input, one float32 row per state, seen from the state's current player. Opponents are ordered by who plays next and padded with zeros up to MAX_PLAYERS, so every block sits at a fixed offset whatever the number of players:
+
+    destAvail - one-hot of the destination cards dealt to choose from (only while choosing)
+
+    destHand - one-hot of the destination cards held
+
+    destCount - destination cards held per opponent
+
+    routesTaken - per player (current first) one-hot of the routes owned
+
+    colorsAvail - face up card counts per color
+
+    colorsCount - the current player's hand, then per opponent the card counting of the current player (9 colors and unknown cards)
+
+    Encoding only reads the states.
+    """
+    def __init__(self, mapData: MapData) -> None:
+        self.destinations = len(mapData.destinationCards)
+        self.routes = len(mapData.weight)
+        self.destAvail = 0
+        self.destHand = self.destAvail + self.destinations
+        self.destCount = self.destHand + self.destinations
+        self.routesTaken = self.destCount + MAX_PLAYERS - 1
+        self.colorsAvail = self.routesTaken + MAX_PLAYERS * self.routes
+        self.colorsCount = self.colorsAvail + 9
+        self.size = self.colorsCount + 9 + (MAX_PLAYERS - 1) * 10
+
+    def encode(self, states: list[CompactState], out: numpy.ndarray = None) -> numpy.ndarray:
+        """
+        Writes the features of the states into out (a (len(states), size) float32 array, allocated if not given) and returns it
+        """
+        batch = len(states)
+        if out is None:
+            out = numpy.empty((batch, self.size), dtype=numpy.float32)
+        out[:batch] = 0
+        if batch == 0:
+            return out
+
+        # Gather the states into padded arrays, then every block is written for the whole batch at once
+        current = numpy.empty(batch, dtype=numpy.intp)
+        numPlayers = numpy.empty(batch, dtype=numpy.intp)
+        owners = numpy.empty((batch, self.routes), dtype=numpy.intp)
+        destinations = numpy.zeros((batch, MAX_PLAYERS, self.destinations), dtype=numpy.float32)
+        hands = numpy.empty((batch, 9), dtype=numpy.float32)
+        counting = numpy.zeros((batch, MAX_PLAYERS, 10), dtype=numpy.float32)
+        faceUp = numpy.empty((batch, 9), dtype=numpy.float32)
+        deals = []
+        for row, state in enumerate(states):
+            player = state.currentPlayer
+            current[row] = player
+            numPlayers[row] = state.numPlayers
+            owners[row] = state.routeOwner
+            destinations[row, :state.numPlayers] = state.destinations
+            hands[row] = state.hands[player]
+            counting[row] = state.colorCounting[player]
+            faceUp[row] = state.faceUpCards
+            if state.followUpFromMove == 3 and state.destinationDeal != None:
+                deals += [(row, destination) for destination in state.destinationDeal]
+
+        rows = numpy.arange(batch)
+        opponents = (current[:, None] + 1 + numpy.arange(MAX_PLAYERS - 1)) % numPlayers[:, None]
+        playing = numpy.arange(MAX_PLAYERS - 1) < numPlayers[:, None] - 1
+
+        # 1. Available destinations
+        if len(deals) > 0:
+            dealt = numpy.array(deals, dtype=numpy.intp)
+            out[dealt[:, 0], self.destAvail + dealt[:, 1]] = 1
+        # 2. Destinations in hand
+        out[:batch, self.destHand:self.destCount] = destinations[rows, current]
+        # 3. Destination count per opponent
+        out[:batch, self.destCount:self.routesTaken] = numpy.where(playing, destinations.sum(axis=2)[rows[:, None], opponents], 0)
+        # 4. Routes taken per player, by seat relative to the current player
+        game, route = numpy.nonzero(owners >= 0)
+        seat = (owners[game, route] - current[game]) % numPlayers[game]
+        out[game, self.routesTaken + seat * self.routes + route] = 1
+        # 5. Available colors
+        out[:batch, self.colorsAvail:self.colorsCount] = faceUp
+        # 6. Colors per player
+        out[:batch, self.colorsCount:self.colorsCount + 9] = hands
+        opponentCounts = numpy.where(playing[:, :, None], counting[rows[:, None], opponents], 0)
+        out[:batch, self.colorsCount + 9:self.size] = opponentCounts.reshape(batch, -1)
+        return out
+
+    def fingerprint(self, state: CompactState) -> tuple[int, bytes]:
+        """
+        A key equal for states with equal features: the Zobrist hash (which covers everything encoded but the card counting) and the current player's card counting
+        """
+        return (state.stateHash(), state.colorCounting[state.currentPlayer].tobytes())
+
+_encoders: dict[str, FeatureEncoder] = {}
+
+def getFeatureEncoder(map: str) -> FeatureEncoder:
+    """
+    Returns the FeatureEncoder of a map, building it on first use
+    """
+    if map not in _encoders:
+        _encoders[map] = FeatureEncoder(getMap(map))
+    return _encoders[map]
@@ -1,30 +1,76 @@
 import math
+import random
+import threading
+import warnings
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy
-from engine.build import State, Action, Game, Agent
-from engine.data import listColors, listDestTakes, product, indexByColor
+from engine.build import Action
+from engine.compact import CompactState
+from engine.data import product, indexByColor
+from engine.moves import getActionSpace
 from models.network import Network
-from copy import deepcopy
+from models.transposition import TranspositionTable
 
 class Node:
     """
     The nodes in the MCTS tree
     
-    Game state - of custom type State (build.py)
+    Game state - of custom type CompactState (compact.py), only kept for the root. The search walks one scratch state down the tree with apply/undo instead of storing a state per node.
+
+    The statistics of the edges below an expanded node are kept by the node in arrays (actions, priors, visits, values - indexed alike), so selection scores all of them at once. A child Node only exists once the search descends into it, its visitCount, aggregateWinningProb and priorProb are read from and written to its parent's arrays at its index (the root keeps its own one-entry arrays).
     """
-    def __init__(self, state: State, priorProb=None, parent=None, fromAction=None, color=None, destDeal=None, routePicked=None, colorsUsed=None) -> None:
+    def __init__(self, state: CompactState = None, priorProb=None, parent=None, fromAction=None, color=None, destDeal=None, routePicked=None, colorsUsed=None, index=0) -> None:
         self.state = state
-        self.visitCount = 1             # N(s,a)
-        self.priorProb = priorProb      # P(s,a)
-        self.aggregateWinningProb = 0   # W(s,a)
+        self.toPlay: int = None if state == None else state.currentPlayer
+        """The player to move at this node, set when the node is expanded"""
         self.parent = parent
         """The parent of the node - of type Node"""
-        self.children: dict[Action: Node] = {}          
-        """The children of the node - of type { Action: Node }"""
-        self.fromAction: Action = Action(None) if fromAction == None else Action(fromAction, colorPicked=color, destinationsPicked=destDeal, routeToPlace=routePicked, colorsUsed=colorsUsed)
+        self.index = index
+        """The position of the node in its parent's arrays"""
+        if parent == None:
+            self.visitArray = numpy.ones(1)
+            self.valueArray = numpy.zeros(1)
+            self.priorArray = numpy.array([0.0 if priorProb == None else priorProb])
+        else:
+            self.visitArray = parent.visits
+            self.valueArray = parent.values
+            self.priorArray = parent.priors
+        self.actions: list[Action] = []
+        """The legal actions from the node once expanded - of custom type Action"""
+        self.priors: numpy.ndarray = None   # P(s,a) per action
+        self.visits: numpy.ndarray = None   # N(s,a) per action, starting at 1
+        self.values: numpy.ndarray = None   # W(s,a) per action
+        self.children: dict[int, Node] = {}
+        """The children of the node that were descended into - of type { index in actions: Node }"""
+        self.fromAction: Action = fromAction if isinstance(fromAction, Action) else Action(None) if fromAction == None else Action(fromAction, colorPicked=color, destinationsPicked=destDeal, routeToPlace=routePicked, colorsUsed=colorsUsed)
         """Each node that is a child stores the action (from its parent) that led to it - of custom type Action"""
         self.terminalState=False
 
+    @property
+    def visitCount(self) -> int:
+        """N(s,a)"""
+        return int(self.visitArray[self.index])
+
+    @visitCount.setter
+    def visitCount(self, value: int) -> None:
+        self.visitArray[self.index] = value
+
+    @property
+    def aggregateWinningProb(self) -> float:
+        """W(s,a)"""
+        return float(self.valueArray[self.index])
+
+    @aggregateWinningProb.setter
+    def aggregateWinningProb(self, value: float) -> None:
+        self.valueArray[self.index] = value
+
+    @property
+    def priorProb(self) -> float:
+        """P(s,a)"""
+        return float(self.priorArray[self.index])
+
     def getMeanWinningProb(self) -> float:
         """Return Q(s,a) - the mean winning probaility for a node/state"""
         if self.visitCount == 0:
@@ -32,202 +78,160 @@ class Node:
         return float(self.aggregateWinningProb / self.visitCount)
     
     def isExpandedNode(self) -> bool:
-        return len(self.children) > 0
+        return len(self.actions) > 0
+
+    def expand(self, actions: list[Action], priors: numpy.ndarray) -> None:
+        """Makes the edges of the legal actions with their priors, no visits and nothing won"""
+        self.actions = actions
+        self.priors = priors
+        self.visits = numpy.ones(len(actions))
+        self.values = numpy.zeros(len(actions))
+
+    def child(self, index: int) -> 'Node':
+        """The child of the action at index, made on the first descent into it"""
+        child = self.children.get(index)
+        if child == None:
+            child = self.children[index] = Node(parent=self, fromAction=self.actions[index], index=index)
+        return child
+
+    def promote(self, actions: list[Action], state: CompactState) -> 'Node':
+        """
+        The node reached from this root by the actions played since its search (see engine.moves.ActionSpace), made the root of state to search again from, with the statistics of its subtree. The rest of the tree is let go. Returns None if the search never went down those actions or if it reached a different position there (another chance outcome of a draw), then a new root has to be made.
+        """
+        space = getActionSpace(self.state.map)
+        scratch = self.state.copy()
+        scratch.stateHash()
+        node = self
+        for action in actions:
+            index = next((i for i, edge in enumerate(node.actions) if space.index(edge) == space.index(action)), None)
+            if index == None or index not in node.children:
+                return None
+            scratch.apply(node.actions[index])
+            node = node.children[index]
+        if scratch.zobrist != state.stateHash() or not numpy.array_equal(scratch.colorCounting, state.colorCounting):
+            return None
+        node.visitArray = numpy.array([node.visitArray[node.index]])
+        node.valueArray = numpy.array([node.valueArray[node.index]])
+        node.priorArray = numpy.array([node.priorArray[node.index]])
+        node.index = 0
+        node.parent = None
+        node.state = state
+        return node
+
+def reuseRoot(previous: Node, actions: list[Action], state: CompactState) -> Node:
+    """
+    The root to search state from: the node of the previous search's tree reached by the actions played since (see Node.promote), or a new node if the tree has none for state
+    """
+    root = None if previous == None else previous.promote(actions, state)
+    return Node(state) if root == None else root
 
 class MonteCarloSearch:
     """The Monte Carlo class for the Ticket to Ride Engine, using a state, it executes the desired number of simulations on that state"""
 
-    def __init__(self, root: Node, simulations=100, pb_c_base=19652, pb_c_init=1.25) -> None:
+    def __init__(self, root: Node, simulations=100, pb_c_base=19652, pb_c_init=1.25, batchSize=1, virtualLoss=1, workers=1, processes=1, seed=None, pool: ProcessPoolExecutor = None, tableSize=1 << 16, network: Network = None) -> None:
+        """
+        root - the node of the state to search, reuseRoot keeps the subtree of the previous move's search under it
+
+        simulations - simulations per search (per process when processes > 1)
+
+        batchSize - leaves collected per network evaluation, virtual loss spreads a batch over different paths
+
+        virtualLoss - losing visits added along the path of every leaf waiting for evaluation
+
+        workers - threads searching the tree together (tree-parallel), each evaluating batchSize leaves at a time. Only pays off with a network whose forward pass releases the GIL (see Network.concurrent), with any other it falls back to one worker.
+
+        processes - independent searches of the root run in a process pool (root-parallel), their root visit counts and values are merged. Each uses the settings of this search and its own network of the given network's cacheSize (networks do not cross processes).
+
+        seed - seeds the searches of the processes (each gets its own stream and so its own root noise), None for a random seed
+
+        pool - a process pool to run them on (kept open between moves to save starting processes), one is made for the search if None
+
+        tableSize - slots of the transposition table sharing expansions between positions reached in different orders (keyed like the evaluation cache, see FeatureEncoder.fingerprint), 0 for no table
+
+        network - the network to evaluate with, pass the same one between moves to keep its evaluation cache (a new one if None)
+        """
         self.logs = []
         self.root: Node = root
-        self.network: Network = Network(root.state.map)
+        self.network: Network = Network(root.state.map) if network == None else network
         self.simulations = simulations
+        self.batchSize = batchSize
+        self.virtualLoss = virtualLoss
+        if workers > 1 and not self.network.concurrent:
+            warnings.warn(f"{type(self.network).__name__} evaluates holding the GIL, tree-parallel workers would only slow the search down: searching with one worker")
+            workers = 1
+        self.workers = workers
+        self.processes = processes
+        self.seed = seed
+        self.pool = pool
+        self.lock: threading.Lock = threading.Lock() if workers > 1 else nullcontext()
+        """Guards the tree's statistics and structure while workers > 1 (does nothing otherwise). It is only held for each selection step, the virtual loss and the expansion and backpropagation of a batch: walking the scratch states, copying the leaves, the network pass and the priors of its outputs all run outside it."""
+        self.remaining = 0
+        """Simulations not yet claimed by a worker"""
+        self.tableSize = tableSize
+        self.table = TranspositionTable(tableSize) if tableSize > 0 else None
+        self.evaluations = 0
+        """States the network evaluated during the search (see Network.evaluations, evaluation cache hits are not counted)"""
+        self.transpositions = 0
+        """Nodes that took over the expansion of an equivalent position"""
         self.pb_c_base = pb_c_base
         self.pb_c_init = pb_c_init
         self.root_dirichlet_alpha = 0.2
         self.root_exploration_fraction = 0.25
         self.numberSamplingMoves = 15
+        self.rootPriors: numpy.ndarray = None
+        """The root's priors with this search's exploration noise (see addNoise)"""
         self.search()
 
-    def getValidMoves(self, state: State, previousAction: int=None, pickedUpWildFromFaceUp: bool=False) -> list[Action]:
-        """Returns a list of type Action that are possible to take from a given state of type State
+    def getValidMoves(self, state: CompactState, previousAction: int=None) -> list[Action]:
+        """Returns a list of type Action that are possible to take from a given state of type CompactState (see engine.moves.ActionSpace.legalMask)
         
         previousAction - context parameter for use in actions that change the game state but not whose turn it is (drawing face up card)"""
-        nextPlayer: Agent = state.players[state.currentPlayer]
-        actionList: list[Action] = []
-        zero = 0
-        one = 0
-        two = 0
-        three = 0
-
-        # Check if the game is over
-        if state.gameOver == True:
-            return []
-
-        # Check for 0 - Placing trains
-        if previousAction == None:
-            for route in state.board.edges(data=True):
-
-                weight = route[2]['weight']
-                # Criteria for ineligible:
-                # 1. Taken
-                # 2. Not enough cards
-                if route[2]['owner'] != '':
-                    continue
-
-                # Can this be completed at all (either color or color + wilds)?
-                # If it can, every combination of cards must be returned. Caveat: all of one color must be used - the engine is not set up for splitting hands. For example, if a player holds 4 blues and 2 wilds and the route calls for 3 blues. There are two combinations possible - 3BLUE and 2WILD, 1BLUE. The engine will never perform a 2BLUE, 1WILD due to the nature of the "desire" architecture for denoting moves.
-
-                # If the route is a color (not gray)
-                if route[2]['color'] != 'GRAY':
-
-                    routeColor = route[2]['color']
-                    numColor = nextPlayer.hand_trainCards.count(routeColor)
-                    numWilds = nextPlayer.hand_trainCards.count('WILD')
-
-                    if numColor == 0:
-                        continue
-                    elif numColor < weight:
-                        # Less than needed - see if wilds can fill it up
-                        if numWilds > 0:
-                            if numWilds + numColor == weight:
-                                actionList.append(Action(0, route, [routeColor, 'WILD']))
-                            elif numWilds + numColor > weight:
-                                actionList.append(Action(0, route, [routeColor, 'WILD']))
-                                if numWilds < weight:
-                                    actionList.append(Action(0, route, ['WILD', routeColor]))
-                    elif numColor >= weight:
-                        actionList.append(Action(0, route, [routeColor]))
-                        if 0 < numWilds < weight:
-                            actionList.append(Action(0, route, ['WILD', routeColor]))
-                
-                # If the route is gray
-                else:
-                    numWilds = nextPlayer.hand_trainCards.count('WILD')
-                    for color in listColors():
-                        # Check if it can be completed with just that color (doesn not include WILD)
-                        numColor = nextPlayer.hand_trainCards.count(color)
-                        if numColor == 0 or color == 'WILD':
-                            # None of color
-                            continue
-                        elif numColor < weight:
-                            # Less than needed - see if wilds can fill it up
-                            if numWilds > 0:
-                                if numWilds + numColor == weight:
-                                    actionList.append(Action(0, route, [color, 'WILD']))
-                                elif numWilds + numColor > weight:
-                                    actionList.append(Action(0, route, [color, 'WILD']))
-                                    if numWilds < weight:
-                                        actionList.append(Action(0, route, ['WILD', color]))
-                        elif numColor >= weight:
-                            # More than needed or equal
-                            actionList.append(Action(0, route, [color]))
-                            # Wildcard cases
-                            if numWilds < weight and numWilds > 0:
-                                actionList.append(Action(0, route, ['WILD', color]))
-                    if numWilds >= weight:
-                        actionList.append(Action(0, route, ['WILD'])) 
-            
-        # Check for 1 & 2 - Draw Face Up or from Deck
-        if previousAction == 1:
-            # If we are drawing the second card
-            if pickedUpWildFromFaceUp == False:
-                # and the first one was not a wild
-                for color in state.faceUpCards:
-                    if color != 'WILD':
-                        actionList.append(Action(1, colorPicked=[color]))
-                        one += 1
-                if len(state.trainCarDeck) >= 1:
-                    actionList.append(Action(2))
-                    two += 1
-        elif previousAction == None or previousAction == 2:
-            if len(state.faceUpCards) + len(state.trainCarDeck) >= 2:
-                for color in state.faceUpCards:
-                    actionList.append(Action(1, colorPicked=[color]))
-                    one += 1
-                if len(state.trainCarDeck) >= 1:
-                    actionList.append(Action(2))
-                    two += 1
-        
-        # Check for 3 - Draw Destination Cards
-        if previousAction == 3:
-            for take in listDestTakes():
-                actionList.append(Action(3, destinationsPicked=take))
-        elif previousAction == None and len(state.destinationDeck) > 2:
-            actionList.append(Action(3))
-
-        # debug output of valid moves
-        # i = 0
-        # for action in actionList:
-        #     i += 1
-        #     if action.action == 0:
-        #         print(action.action, action.routeToPlace, action.colorsUsed)
-        #     elif action.action == 1:
-        #         print(action.action, action.colorPicked)
-        #     elif action.action == 2:
-        #         print(action.action)
-        #     elif action.action == 3:
-        #         print(action.action, action.destinationsPicked)
-        # print(f"Possible moves from turn {state.turn} = {i}")
-
-        return actionList
-
-    def ucb_score(self, parent: Node, child: Node) -> float:
-        pb_c = math.log((parent.visitCount + self.pb_c_base + 1) / self.pb_c_base) + self.pb_c_init
-        pb_c *= math.sqrt(parent.visitCount) / (child.visitCount + 1)
-        U_sa = pb_c * child.priorProb
-        Q_sa = child.getMeanWinningProb()
+        return getActionSpace(state.map).legalActions(state, previousAction)[1]
+
+    def ucbScores(self, node: Node) -> numpy.ndarray:
+        """U(s,a) + Q(s,a) of every action of an expanded node"""
+        visitCount = node.visitCount
+        pb_c = math.log((visitCount + self.pb_c_base + 1) / self.pb_c_base) + self.pb_c_init
+        # Edges start at one visit and virtual loss only adds to them, so no visit count is 0
+        visits = node.visits
+        priors = self.rootPriors if node is self.root else node.priors
+        U_sa = (pb_c * math.sqrt(visitCount)) * priors / (visits + 1)
+        Q_sa = node.values / visits
         return U_sa + Q_sa
 
     def select_child(self, node: Node) -> tuple[Action, Node]:
         """Selects the child based on the CPUCT formula in the AlphaGoZero paper"""
-        max: tuple[int, Action, Node] = (0, None, None)
-        x: Node = None
-        for action, child in node.children.items():
-            # Debugging terminal state
-            # x = child
-            # y = action
-            # break
-            score = self.ucb_score(node, child)
-            if score > max[0]:
-                max = (score, action, child)
-        # return y, x
-        return max[2]
+        index = int(numpy.argmax(self.ucbScores(node)))
+        return node.actions[index], node.child(index)
     
-    def evaluateNode(self, node: Node, network: Network) -> float:
-        """Expands a current node, returns the probability of winning generated by the network"""
-        a, Dc, Dd, Dr, w_p = network.play(node.state) # Get neural network forward pass evaluation
-        policy = {}
-        policySum = 0
-        pickedWild = False
-        if node.fromAction == 1:
-            if node.fromAction.colorPicked != None:
-                pickedWild = True if node.fromAction.colorPicked == ['WILD'] else False
-        validMoves = self.getValidMoves(node.state, node.state.followUpFromMove, pickedWild)
+    def evaluateNode(self, node: Node, state: CompactState, network: Network) -> float:
+        """Expands a current node given the state at that node, returns the probability of winning generated by the network"""
+        return self.expandNode(node, state, network.play(state)) # Get neural network forward pass evaluation
+
+    def expandNode(self, node: Node, state: CompactState, output: tuple) -> float:
+        """Expands a node given the state at that node and the network output for it (see Network.play), returns the probability of winning"""
+        node.toPlay = state.currentPlayer
+        validMoves, priors = self.priorsOf(state, output)
+        if len(validMoves) > 0:
+            node.expand(validMoves, priors)
+        return output[4]
+
+    def priorsOf(self, state: CompactState, output: tuple) -> tuple[list[Action], numpy.ndarray]:
+        """The legal actions of a state and their prior probabilities from the network output for it (None if there are no legal actions). Only reads the state, so tree-parallel workers call it outside the tree lock."""
+        a, Dc, Dd, Dr, w_p = output
+        validMoves = self.getValidMoves(state, state.followUpFromMove)
         # if len(validMoves) == 0:
         #     print("evaluateNode: The game is over at this node! Printing log...") # Debug
         #     file = open("log2.txt", "w")
         #     file.writelines(self.logs)
         #     quit()
         #     return w_p
-        for action in validMoves:
-            value = self.getValue(action, a, Dc, Dd, Dr, node.state.destinationDeal)
-            policy[action] = value**2
-            policySum += value
-        for action, value in policy.items():
-            action: Action
-            newState, colorPicked, destDeal = self.newState(node.state, action)
-            node.children[action] = Node(newState, priorProb=value/policySum, parent=node, fromAction=action.action, color=colorPicked, destDeal=destDeal, routePicked=action.routeToPlace, colorsUsed=action.colorsUsed)
-        return w_p
+        if len(validMoves) == 0:
+            return validMoves, None
+        policy = numpy.array([self.getValue(action, a, Dc, Dd, Dr, state.destinationDeal) for action in validMoves])
+        return validMoves, policy**2 / policy.sum()
     
-    def newState(self, state: State, action: Action) -> State:
-        """Takes a state and an action, and returns a new, deepcopied state which has carried out the action."""
-        newGame = Game(state.map, state.players, False, False, False, state)
-        newGame.performActionFrozen(newGame.players[state.currentPlayer], action)
-        newState = State(newGame.board, newGame.faceUpCards, newGame.trainCarDeck, newGame.destinationsDeck, newGame.players, newGame.turn, newGame.mapName, newGame.movePerforming, newGame.wildFromFaceUp, newGame.destinationDeal, newGame.validGameMoves, newGame.actionMap, newGame.lastTurn, newGame.endedGame, newGame.gameOver)
-        return newState, newGame.colorPicked, newGame.destinationDeal, 
-
-    def getValue(self, action: Action, a: list[float], Dc: list[float], Dd: list[float], Dr: list[float], destDeal: list[list]) -> float:
+    def getValue(self, action: Action, a: list[float], Dc: list[float], Dd: list[float], Dr: list[float], destDeal: tuple[int]) -> float:
         """Takes the ouput of the network and a valid action to take and returns a float representing how 'confident' the network is in making that move. The higher the float the higher the confidence."""
         a_p = a[action.action]
         Dc_p = 1
@@ -243,63 +247,178 @@ class MonteCarloSearch:
         elif action.action == 3:
             if action.destinationsPicked != None:
                 for indexOfDeal in action.destinationsPicked:
-                    Dd_p *= Dd[destDeal[indexOfDeal][3]]
+                    Dd_p *= Dd[destDeal[indexOfDeal]]
                 return product(a_p, Dd_p)
             else:
                 return a_p
         elif action.action == 2:
             return a_p
 
+    def addVirtualLoss(self, searchPath: list[Node], sign: int = 1):
+        """Adds (or with sign -1 removes) the virtual loss of a leaf waiting for evaluation: visits that won nothing, so other selections of the batch prefer other paths"""
+        for node in searchPath:
+            node.visitCount += sign * self.virtualLoss
+
     def backprop(self, searchPath: list[Node], win_p: float, toPlay: int):
         for node in searchPath:
             node.visitCount += 1
-            if toPlay == node.state.currentPlayer:
+            if toPlay == node.toPlay:
                 node.aggregateWinningProb += win_p
             else:
                 node.aggregateWinningProb += (1-win_p)
     
     def addNoise(self, root: Node):
-        actions = root.children.keys()
-        noise = numpy.random.gamma(self.root_dirichlet_alpha, 1, len(actions))
-        for action, noise in zip(actions, noise):
-            root.children[action].priorProb = root.children[action].priorProb * (1 - self.root_exploration_fraction) + noise * self.root_exploration_fraction
+        """Draws this search's Dirichlet noise over the root's priors into rootPriors, the node keeps the network's priors (a root kept for the next move or shared by the transposition table must not carry it)"""
+        noise = numpy.random.gamma(self.root_dirichlet_alpha, 1, len(root.actions))
+        self.rootPriors = root.priors * (1 - self.root_exploration_fraction) + noise * self.root_exploration_fraction
     
     def select_action(self, root: Node):
         pass
         
 
 
-    def search(self):
-
-        self.evaluateNode(self.root, self.network)
-        self.addNoise(self.root)
+    def shareExpansion(self, node: Node, state: CompactState) -> bool:
+        """Gives an unexpanded node the children of the node expanded for the same position (state is the node's), if the transposition table has one. Returns whether it did."""
+        if self.table == None:
+            return False
+        shared = self.table.get(self.network.encoder.fingerprint(state))
+        if shared == None or shared is node or not shared.isExpandedNode():
+            return False
+        node.actions, node.priors, node.visits, node.values, node.children = shared.actions, shared.priors, shared.visits, shared.values, shared.children
+        node.toPlay = shared.toPlay
+        self.transpositions += 1
+        return True
 
-        for _ in range(self.simulations):
+    def collectLeaves(self, scratch: CompactState, count: int) -> tuple[list[tuple[Node, CompactState]], list[tuple[list[Node], int]]]:
+        """Descends count search paths from the root, walking the scratch state down and back up and adding virtual loss along each path. Returns the leaves to evaluate with copies of their states, and the paths with the leaf each ends at. Takes the tree lock itself, per selection step."""
+        leaves: list[tuple[Node, CompactState]] = [] # The leaves to evaluate and their states
+        pending: dict[Node, int] = {} # The leaves already in the batch, by position
+        paths: list[tuple[list[Node], int]] = [] # The search paths of the batch and which leaf they end at
+        for _ in range(count):
             currentNode = self.root # Start at the beginning
             searchPath: list[Node] = [currentNode] # The actions that have brought us to this state in MCTS
+            undoTokens = []
 
-            while currentNode.isExpandedNode(): # If a node has children
-                node = self.select_child(currentNode) # Select one
+            while True:
+                with self.lock:
+                    if not (currentNode.isExpandedNode() or self.shareExpansion(currentNode, scratch)): # If a node has children
+                        break
+                    action, node = self.select_child(currentNode) # Select one
+                undoTokens.append(scratch.apply(action))
                 searchPath.append(node) # Add the child to the current path we are going down
                 currentNode = node
-            
+
             # TERMINAL STATE DEBUGGING
             # print(f"search: turn {node.state.turn} current node came from {node.fromAction}, player to play is player {node.state.currentPlayer}")
             # self.logs = self.logs + [f"\nTURN {node.state.turn} FROM {action}\n", f"{node.state.players[node.state.currentPlayer].turnOrder} : {node.state.players[node.state.currentPlayer].trainsLeft}, {node.state.players[node.state.currentPlayer].hand_trainCards}\n", f"  {node.state.faceUpCards}\n", f" {node.state.destinationDeck}\n", f" {node.state.trainCarDeck}\n"]
             # print(f"search: search path length is {len(searchPath)}")
-            print(len(searchPath))
-            win_p = self.evaluateNode(currentNode, self.network)
-            self.backprop(searchPath, win_p, searchPath[-1].state.currentPlayer)
-            # If we found a terminal state
-            if len(node.children) == 0:
-                node.terminalState = True
-                print("Found terminal state...")
-        
-        return select_action()
-        
-            
 
-            
+            # Paths of one batch can end at the same leaf, it is evaluated once
+            if currentNode not in pending:
+                pending[currentNode] = len(leaves)
+                leaves.append((currentNode, scratch.copy()))
+            leaf = pending[currentNode]
+            paths.append((searchPath, leaf))
+            with self.lock:
+                self.addVirtualLoss(searchPath)
 
+            # Walk the scratch state back up to the root
+            for token in reversed(undoTokens):
+                scratch.undo(token)
+        return leaves, paths
 
-    
+    def finishLeaves(self, leaves: list[tuple[Node, CompactState]], paths: list[tuple[list[Node], int]], outputs: list[tuple]) -> None:
+        """Expands the evaluated leaves (unless another worker or an equivalent position expanded them first), takes back the virtual loss and backpropagates every path. The priors are worked out before taking the tree lock."""
+        priors = [self.priorsOf(state, output) for (_, state), output in zip(leaves, outputs)]
+        values = [output[4] for output in outputs]
+        with self.lock:
+            for (node, state), (validMoves, prior) in zip(leaves, priors):
+                if not node.isExpandedNode() and not self.shareExpansion(node, state):
+                    node.toPlay = state.currentPlayer
+                    if len(validMoves) > 0:
+                        node.expand(validMoves, prior)
+                    if self.table != None:
+                        self.table.put(self.network.encoder.fingerprint(state), node)
+            for searchPath, leaf in paths:
+                currentNode = leaves[leaf][0]
+                self.addVirtualLoss(searchPath, -1)
+                self.backprop(searchPath, values[leaf], currentNode.toPlay)
+                # If we found a terminal state
+                if not currentNode.isExpandedNode() and not currentNode.terminalState:
+                    currentNode.terminalState = True
+                    print("Found terminal state...")
+
+    def searchWorker(self) -> None:
+        """One thread of the tree-parallel search: claims simulations until none are left. collectLeaves and finishLeaves take the tree lock for the tree's updates only, so the state walks and network evaluations of different workers overlap."""
+        scratch = self.root.state.copy() # This worker's state walked up and down the tree
+        scratch.stateHash()
+        while True:
+            with self.lock:
+                count = min(self.batchSize, self.remaining)
+                if count == 0:
+                    return
+                self.remaining -= count
+            leaves, paths = self.collectLeaves(scratch, count)
+            outputs = self.network.playBatch([state for _, state in leaves])
+            self.finishLeaves(leaves, paths, outputs)
+
+    def searchRootParallel(self) -> None:
+        """Root-parallel search: runs independent searches of the root state in processes and merges their root children's visit counts and values into this root, which then reads like the root of one search of all their simulations"""
+        seeds = [int(s.generate_state(1, numpy.uint64)[0]) for s in numpy.random.SeedSequence(self.seed).spawn(self.processes)]
+        args = ([self.root.state]*self.processes, [self.simulations]*self.processes, [self.batchSize]*self.processes, [self.virtualLoss]*self.processes, [self.workers]*self.processes, seeds, [self.tableSize]*self.processes, [self.network.cacheSize]*self.processes)
+        if self.pool == None:
+            with ProcessPoolExecutor(self.processes) as pool:
+                results = list(pool.map(searchRoot, *args))
+        else:
+            results = list(self.pool.map(searchRoot, *args))
+
+        actions = getActionSpace(self.root.state.map).actions
+        position = {action: i for i, action in enumerate(self.root.actions)}
+        for result, evaluations in results:
+            self.network.countEvaluations(evaluations)
+            indexes = [position[actions[index]] for index in result]
+            visits, values = zip(*result.values()) if len(result) > 0 else ((), ())
+            # Every edge starts with one visit, the searches add theirs to it
+            numpy.add.at(self.root.visits, indexes, numpy.array(visits) - 1)
+            numpy.add.at(self.root.values, indexes, values)
+        self.root.visitCount = 1 + int((self.root.visits - 1).sum())
+
+    def search(self):
+
+        scratch = self.root.state.copy() # The one state walked up and down the tree
+        scratch.stateHash() # apply keeps it up to date from here, for the transposition table and the evaluation cache
+        evaluated = self.network.evaluations
+        # A root kept from the previous move (see reuseRoot) is already expanded, the search adds to its subtree
+        if not self.root.isExpandedNode():
+            self.evaluateNode(self.root, scratch, self.network)
+        if self.table != None:
+            self.table.put(self.network.encoder.fingerprint(scratch), self.root)
+        self.addNoise(self.root)
+
+        if self.processes > 1:
+            self.searchRootParallel()
+        elif self.workers > 1:
+            # Tree-parallel, virtual loss keeps the workers on different paths
+            self.remaining = self.simulations
+            with ThreadPoolExecutor(self.workers) as pool:
+                for worker in [pool.submit(self.searchWorker) for _ in range(self.workers)]:
+                    worker.result()
+        else:
+            for done in range(0, self.simulations, self.batchSize):
+                leaves, paths = self.collectLeaves(scratch, min(self.batchSize, self.simulations - done))
+                # One network pass for the whole batch
+                self.finishLeaves(leaves, paths, self.network.playBatch([state for _, state in leaves]))
+        self.evaluations = self.network.evaluations - evaluated
+        
+        return self.select_action(self.root)
+
+def searchRoot(state: CompactState, simulations: int, batchSize: int, virtualLoss: int, workers: int, seed: int, tableSize: int, cacheSize: int) -> tuple[dict[int, tuple[int, float]], int]:
+    """
+    Process pool worker of root-parallel search: searches the state with its own seed, transposition table and network (with an evaluation cache of cacheSize), returns the root children's (visit count, aggregate winning probability) by engine.moves.ActionSpace index and the states the network evaluated
+    """
+    random.seed(seed)
+    numpy.random.seed(seed % 2**32)
+    search = MonteCarloSearch(Node(state), simulations, batchSize=batchSize, virtualLoss=virtualLoss, workers=workers, tableSize=tableSize, network=Network(state.map, cacheSize))
+    space = getActionSpace(state.map)
+    root = search.root
+    return {space.index(root.actions[index]): (int(root.visits[index]), float(root.values[index])) for index in root.children}, search.network.evaluations
@@ -1,25 +1,39 @@
 import random
-from engine.build import State
-from engine.data import listColors
-from engine.players import Agent
+import threading
+from engine.compact import CompactState
+from models.cache import EvaluationCache
+from models.features import getFeatureEncoder
 # import tensorflow as tf
 # import keras
 # from keras import layers
 
 class Network:
     """The actual network object that powers the AI agent"""
-    def __init__(self, map: str) -> None:
+    concurrent = False
+    """Whether forward passes release the GIL so that tree-parallel search threads overlap (see MonteCarloSearch workers), the placeholder forward pass is pure Python"""
+
+    def __init__(self, map: str, cacheSize: int = 1 << 12) -> None:
+        """
+        cacheSize - evaluations kept (least recently used evicted first) so that states seen again are not evaluated again, 0 for no cache
+        """
         self.map = map
+        self.cacheSize = cacheSize
+        self.encoder = getFeatureEncoder(map)
+        self.cache = EvaluationCache(cacheSize) if cacheSize > 0 else None
+        self.evaluations = 0
+        """States that went through a forward pass (cache hits are not counted)"""
+        self.lock = threading.Lock()
+        """Guards the count, playBatch may be called from several search threads"""
         
         # Build the network
         # model = keras.Sequential()
         # model.add(layers.Embedding)
     
-    def play(self, state: State):
+    def play(self, state: CompactState):
         """
         Tell the network to evaluate a game state
 
-        Input - a state of type State (turns into one long vector of [avail. dest] + [dest. in hand] + [dest. count/player] + [routes taken] + [avail. colors] + [colors/player])
+        Input - a state of type CompactState (turns into one long vector of [avail. dest] + [dest. in hand] + [dest. count/opponent] + [routes taken/player] + [avail. colors] + [colors/player], see models.features.FeatureEncoder)
 
         Outputs - (a, Dc, Dd, Dr, W)
 
@@ -33,51 +47,36 @@ class Network:
 
         W = win probability from state
         """
-        # Transform state into network input
+        return self.playBatch([state])[0]
 
-        # 1. Available Destinations
-        destAvail = [0]*30 # 30 destination cards in USA map
-        if state.followUpFromMove == 3:
-            destDealRaw = [state.destinationDeck.pop(), state.destinationDeck.pop(), state.destinationDeck.pop()]
-            for destination in destDealRaw:
-                destAvail[destination[3]]=1
-        
-        #2. Destinations in Hand
-        currentPlayer: Agent = state.players[state.currentPlayer]
-        destHand = [0]*30 # 30 destination cards in USA map
-        for destination in currentPlayer.hand_destinationCards:
-            destHand[destination[3]]=1
-        
-        #3. Destination count per opponent [next to go, after, etc.], must be of length three padded with zeros ENDED HERE
-        destCount = []
-        for i in range(state.currentPlayer + 1, state.currentPlayer + len(state.players)):
-            destCount.append(len(state.players[i % len(state.players)].hand_destinationCards))
-        while len(destCount) != 3:
-            destCount.append(0)
-        
-        #4. Routes Taken per player [current, next to go, after, etc.]
-        routesTaken = []
-        for i in range(state.currentPlayer, state.currentPlayer + len(state.players)):
-            taken = [0]*100 # 100 routes in USA map
-            edges = [edge for edge in state.board.edges(data=True) if edge[2]['owner'] == i % len(state.players)]
-            for edge in edges:
-                taken[edge[2]['index']] = 1
-            routesTaken += taken
+    def playBatch(self, states: list[CompactState]) -> list[tuple]:
+        """
+        Evaluates a batch of game states, returns the outputs of play for each state in order. States found in the cache are not evaluated again, the others go through the network in one forward pass.
+        """
+        if self.cache == None:
+            self.countEvaluations(len(states))
+            return self.forward(states)
+        keys = [self.encoder.fingerprint(state) for state in states]
+        outputs = [self.cache.get(key) for key in keys]
+        missing = [i for i, output in enumerate(outputs) if output == None]
+        if len(missing) > 0:
+            self.countEvaluations(len(missing))
+            for i, output in zip(missing, self.forward([states[i] for i in missing])):
+                outputs[i] = output
+                self.cache.put(keys[i], output)
+        return outputs
 
-        #5. Available colors
-        colorsAvail = [] # 9 colors in game
-        for color in listColors():
-            colorsAvail.append(state.faceUpCards.count(color))
+    def countEvaluations(self, count: int) -> None:
+        with self.lock:
+            self.evaluations += count
 
-        #6. Colors / Player (TODO: check the accuracy of the card counting for opponents AND ordering at some point)
-        colorsCount = [currentPlayer.hand_trainCards.count(color) for color in listColors()]
-        for i in range(state.currentPlayer + 1, state.currentPlayer + len(state.players)):
-            colorsCount += currentPlayer.colorCounting[i % len(state.players)]
-        while len(colorsCount) != 39:
-            colorsCount.append(0)
-        
-        print(len(destAvail), len(destHand), len(destCount), len(routesTaken), len(colorsAvail), len(colorsCount))
+    def forward(self, states: list[CompactState]) -> list[tuple]:
+        """
+        One forward pass of the network over a batch of game states
+        """
+        # Transform the states into the network input (see models.features.FeatureEncoder for the layout)
+        features = self.encoder.encode(states)
 
-        # network.output(param: the long vector)
+        # network.output(param: the batch of long vectors)
 
-        return ([random.random() for i in range(4)], [random.random() for i in range(9)], [random.random() for i in range(30)], [random.random() for i in range(100)], random.random())
+        return [([random.random() for i in range(4)], [random.random() for i in range(9)], [random.random() for i in range(30)], [random.random() for i in range(100)], random.random()) for _ in states]
@@ -0,0 +1,27 @@
+class TranspositionTable:
+    """
+    Expanded search nodes by the key of their position, the FeatureEncoder.fingerprint of its state (the Zobrist hash and the card counting of the player to move), so that a position reached through a different order of moves shares the expansion and the statistics below it instead of being evaluated again.
+
+    The table has a fixed number of slots (a power of two) indexed by the low bits of the key's hash. When two positions want the same slot, the node with more visits keeps it.
+    """
+    def __init__(self, size: int) -> None:
+        self.size = 1 << max(size - 1, 0).bit_length()
+        self.mask = self.size - 1
+        self.keys: list[tuple] = [None]*self.size
+        self.nodes: list = [None]*self.size
+
+    def get(self, key: tuple):
+        """
+        The node stored for the key, None if there is none
+        """
+        slot = hash(key) & self.mask
+        return self.nodes[slot] if self.keys[slot] == key else None
+
+    def put(self, key: tuple, node) -> None:
+        """
+        Stores the node for the key, unless its slot holds another position's node with more visits
+        """
+        slot = hash(key) & self.mask
+        if self.nodes[slot] == None or self.keys[slot] == key or self.nodes[slot].visitCount <= node.visitCount:
+            self.keys[slot] = key
+            self.nodes[slot] = node
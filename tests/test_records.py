@@ -0,0 +1,32 @@
+import random
+import numpy
+from engine.build import Game
+from engine.compact import CompactState
+from engine.players import Random
+from engine.records import getTraceCodes, replayCompact
+
+def stoppedGames(count: int) -> list[Game]:
+    """
+    Plays seeded games until count of them were ended by the debug stop
+    """
+    games = []
+    seed = 0
+    while len(games) < count:
+        random.seed(seed)
+        game = Game('USA', [Random(), Random(), Random()], False)
+        if getTraceCodes(game.mapName).stop in game.trace:
+            games.append(game)
+        seed += 1
+    return games
+
+def test_replay_matches_stopped_games():
+    """Replaying the record of a game stopped by the debug stop gives the state the game ended in (points aside, endGame scores tickets and the longest route)"""
+    for game in stoppedGames(60):
+        replayed = replayCompact(game.record())
+        live = CompactState.fromGame(game)
+        for field in ['routeOwner', 'hands', 'trainsLeft', 'destinations', 'faceUpCards', 'colorCounting']:
+            assert numpy.array_equal(getattr(replayed, field), getattr(live, field)), field
+        assert replayed.trainCarList() == live.trainCarList()
+        assert replayed.destinationList() == live.destinationList()
+        assert (replayed.turn, replayed.currentPlayer, replayed.lastTurn, replayed.endedGame) == (live.turn, live.currentPlayer, live.lastTurn, live.endedGame)
+        assert (replayed.followUpFromMove, replayed.destinationDeal) == (live.followUpFromMove, live.destinationDeal)